@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+
+"""Persistent on-disk cache of compiled artifacts, shared between processes.
+
+The cache directory is given by the OPENFISCA_TUNISIA_CACHE_DIR environment variable and defaults to
+~/.cache/openfisca-tunisia. Setting this variable to an empty string disables the cache.
+"""
+
+
+import cPickle as pickle
+import errno
+import hashlib
+import logging
+import os
+import tempfile
+
+
+log = logging.getLogger(__name__)
+
+CACHE_DIR_ENVIRONMENT_VARIABLE = 'OPENFISCA_TUNISIA_CACHE_DIR'
+
+
+def get_cache_dir():
+    cache_dir = os.environ.get(CACHE_DIR_ENVIRONMENT_VARIABLE)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'openfisca-tunisia')
+    return cache_dir or None
+
+
+def make_key(*parts):
+    key = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        key.update(str(len(part)))
+        key.update(':')
+        key.update(part)
+    return key.hexdigest()
+
+
+def get_path(namespace, key):
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return None
+    return os.path.join(cache_dir, namespace, '{}.pickle'.format(key))
+
+
+def load(namespace, key):
+    """Return the value stored under namespace and key, or None when it is missing or unreadable."""
+    path = get_path(namespace, key)
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as cache_file:
+            return pickle.load(cache_file)
+    except Exception:
+        log.warning(u'Ignoring unreadable cache file {}'.format(path), exc_info = True)
+        return None
+
+
+def dump(namespace, key, value):
+    """Store value under namespace and key.
+
+    The value is written to a temporary file which is then renamed, so that concurrent processes never read a
+    partially written file. Failures are logged and otherwise ignored: the cache is only an optimization.
+    """
+    path = get_path(namespace, key)
+    if path is None:
+        return
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory)
+    except OSError as exception:
+        if exception.errno != errno.EEXIST:
+            log.warning(u'Unable to create cache directory {}: {}'.format(directory, exception))
+            return
+    temporary_path = None
+    try:
+        file_descriptor, temporary_path = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+        with os.fdopen(file_descriptor, 'wb') as cache_file:
+            pickle.dump(value, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary_path, path)
+    except (IOError, OSError, TypeError, pickle.PicklingError) as exception:
+        log.warning(u'Unable to write cache file {}: {}'.format(path, exception))
+        if temporary_path is not None and os.path.exists(temporary_path):
+            os.remove(temporary_path)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+
+"""Calculation of many output variables at once, scheduled with the dependency graph of the model.
+
+The variables required by the outputs are planned once, from the static dependency graph, and calculated in
+topological order: when a formula runs, the inputs it requests are already calculated, so the recursive resolution of
+the simulation stops at the first level. The intermediate variables are freed as soon as their last consumer has run,
+which bounds the memory used by the calculation. Each planned node keeps the options of its request: inputs requested
+with ADD or DIVIDE are calculated with calculate_add or calculate_divide. Dependencies that can't be planned (periods
+or options computed at run time, inputs of variables requested with options, variables updated by a reform) are still
+resolved recursively by the simulation.
+
+Known limitation: the sub-periods of a node requested with ADD or DIVIDE are chosen at run time, by the periods the
+formula of its variable returns (the months of the year for ugtt), so they are not planned. The inputs calculated for
+these sub-periods (the monthly intermediates of ugtt) are not freed by calculate_many, and stay cached in the
+simulation like with simulation.calculate.
+"""
+
+
+import collections
+
+from openfisca_core import periods as periods_module
+
+from openfisca_tunisia import dependencies
+from openfisca_tunisia.model.base import is_input_variable
+
+
+def get_dependency_graph(tax_benefit_system):
+    """Return the dependency graph of a tax benefit system, or of the reference of a reform."""
+    while tax_benefit_system is not None:
+        get_dependency_graph = getattr(tax_benefit_system, 'get_dependency_graph', None)
+        if get_dependency_graph is not None:
+            return get_dependency_graph()
+        tax_benefit_system = getattr(tax_benefit_system, 'reference', None)
+    return dependencies.DependencyGraph()
+
+
+def has_arrays(holder):
+    return getattr(holder, '_array', None) is not None or bool(getattr(holder, '_array_by_period', None))
+
+
+def free_holder(holder):
+    if hasattr(holder, 'delete_arrays'):
+        holder.delete_arrays()
+    else:
+        holder._array = None
+        holder._array_by_period = None
+
+
+def wrap_methods(instance, methods_name, make_wrapper):
+    """Replace the methods of an instance (a simulation) by the wrappers returned by make_wrapper(method), and return a
+    function restoring them.
+
+    Methods the instance doesn't have are skipped. The wrappers are instance attributes, so they are also called by the
+    instance itself. A method wrapped twice is restored to the previous wrapper.
+    """
+    previous_method_by_name = dict(
+        (method_name, vars(instance).get(method_name))
+        for method_name in methods_name
+        if hasattr(instance, method_name)
+        )
+    for method_name in previous_method_by_name:
+        setattr(instance, method_name, make_wrapper(getattr(instance, method_name)))
+
+    def restore():
+        for method_name, previous_method in previous_method_by_name.iteritems():
+            if previous_method is None:
+                delattr(instance, method_name)
+            else:
+                setattr(instance, method_name, previous_method)
+        previous_method_by_name.clear()
+
+    return restore
+
+
+def transform_period(period, period_transform):
+    """Apply a dotted path of period properties (see dependencies.Dependency) to period, or return None."""
+    for property_name in period_transform.split(u'.') if period_transform else []:
+        period = getattr(period, property_name, None)
+        if period is None or not isinstance(period, periods_module.Period):
+            return None
+    return period
+
+
+def plan(graph, requested_nodes):
+    """Return the inputs of each (variable name, period, options) node required by the requested ones.
+
+    The inputs of nodes having options are not planned: their variable is calculated for other periods than the period
+    of the node (for example month by month for ADD), known only when its formula runs. They are not freed (see the
+    module docstring).
+    """
+    inputs_node_by_node = {}
+    pending_nodes = list(requested_nodes)
+    while pending_nodes:
+        node = pending_nodes.pop()
+        if node in inputs_node_by_node:
+            continue
+        variable_name, period, options = node
+        inputs_node = set()
+        for dependency in graph.dependencies_by_variable_name.get(variable_name, ()) if not options else ():
+            if dependency.period_transform is None or dependency.options is None:
+                continue
+            input_period = transform_period(period, dependency.period_transform)
+            if input_period is not None:
+                inputs_node.add((dependency.variable_name, input_period, dependency.options))
+        inputs_node.discard(node)
+        inputs_node_by_node[node] = inputs_node
+        pending_nodes.extend(inputs_node)
+    return inputs_node_by_node
+
+
+def sort_nodes(inputs_node_by_node, requested_nodes):
+    """Return the planned nodes, each node after its inputs. Cycles are broken arbitrarily."""
+
+    def sorted_inputs(node):
+        return iter(sorted(inputs_node_by_node[node], key = lambda input_node: (input_node[0],
+            unicode(input_node[1]), input_node[2])))
+
+    sorted_nodes = []
+    visited_nodes = set()
+    for root_node in requested_nodes:
+        if root_node in visited_nodes:
+            continue
+        visited_nodes.add(root_node)
+        stack = [(root_node, sorted_inputs(root_node))]
+        while stack:
+            node, inputs_node = stack[-1]
+            for input_node in inputs_node:
+                if input_node not in visited_nodes:
+                    visited_nodes.add(input_node)
+                    stack.append((input_node, sorted_inputs(input_node)))
+                    break
+            else:
+                stack.pop()
+                sorted_nodes.append(node)
+    return sorted_nodes
+
+
+def calculate_node(simulation, node):
+    variable_name, period, options = node
+    if u'ADD' in options:
+        return simulation.calculate_add(variable_name, period = period)
+    if u'DIVIDE' in options:
+        return simulation.calculate_divide(variable_name, period = period)
+    return simulation.calculate(variable_name, period = period)
+
+
+def calculate_many(simulation, variables_name, periods = None):
+    """Calculate variables for periods (the period of the simulation by default) and return their arrays, by
+    (variable name, period).
+
+    Intermediate variables are freed after their last use, unless they had already been calculated before the call.
+    Input variables and requested variables are never freed.
+    """
+    if periods is None:
+        periods = [simulation.period]
+    elif isinstance(periods, (basestring, int, periods_module.Period)):
+        periods = [periods]
+    periods = [periods_module.period(period) for period in periods]
+    requested_nodes = [
+        (variable_name, period, ())
+        for period in periods
+        for variable_name in variables_name
+        ]
+
+    inputs_node_by_node = plan(get_dependency_graph(simulation.tax_benefit_system), requested_nodes)
+    sorted_nodes = sort_nodes(inputs_node_by_node, requested_nodes)
+
+    # Number of evaluations and of consumers left before a variable can be freed
+    pending_uses_count_by_variable_name = collections.Counter()
+    for node, inputs_node in inputs_node_by_node.iteritems():
+        pending_uses_count_by_variable_name[node[0]] += 1
+        for input_name, _, _ in inputs_node:
+            pending_uses_count_by_variable_name[input_name] += 1
+    column_by_name = simulation.tax_benefit_system.column_by_name
+    requested_nodes_set = set(requested_nodes)
+    requested_variables_name = set(variables_name)
+    freeable_variables_name = set(
+        variable_name
+        for variable_name in pending_uses_count_by_variable_name
+        if variable_name not in requested_variables_name
+        and variable_name in column_by_name and not is_input_variable(column_by_name[variable_name])
+        and not has_arrays(simulation.holder_by_name.get(variable_name))
+        )
+
+    array_by_node = {}
+    for node in sorted_nodes:
+        variable_name = node[0]
+        array = calculate_node(simulation, node)
+        if node in requested_nodes_set:
+            array_by_node[node] = array
+        for used_variable_name in [variable_name] + [input_name for input_name, _, _ in inputs_node_by_node[node]]:
+            pending_uses_count_by_variable_name[used_variable_name] -= 1
+            if pending_uses_count_by_variable_name[used_variable_name] == 0 \
+                    and used_variable_name in freeable_variables_name:
+                holder = simulation.holder_by_name.get(used_variable_name)
+                if holder is not None:
+                    free_holder(holder)
+    return collections.OrderedDict(
+        (node[:2], array_by_node[node] if node in array_by_node else calculate_node(simulation, node))
+        for node in requested_nodes
+        )
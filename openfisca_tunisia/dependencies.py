@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+
+"""Dependency graph of the variables of the model.
+
+Formulas request their inputs through calls like foyer_fiscal('rni', period = period): the graph is extracted from the
+source of the model modules, by static analysis of these calls, including those made by module level helper functions.
+Each dependency records the projection used to reach the input (members, foyer_fiscal, declarant_principal, etc.),
+the transform applied to the period (this_year, etc.) and the options of the request (ADD, DIVIDE). Variables whose
+input names are computed at run time are completed by tracing the calculations of a simulation.
+"""
+
+
+import ast
+import collections
+import os
+
+from openfisca_tunisia import cache
+
+
+COUNTRY_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(COUNTRY_DIR, 'model')
+CACHE_NAMESPACE = 'dependencies'
+# Attributes of entities whose calls don't request a variable to compute
+IGNORED_ATTRIBUTES = frozenset(['get_holder', 'get_or_new_holder', 'holder_by_name', 'simulation'])
+
+Dependency = collections.namedtuple('Dependency', ['variable_name', 'projection', 'period_transform', 'options'])
+
+
+class DependencyGraph(object):
+    """Variables required by the formula of each variable.
+
+    projection is the dotted path of the entity attribute used to request an input ('' when it is requested directly
+    to the entity of the variable). period_transform is the dotted path of the period properties applied to the
+    period of the variable ('' for the same period), or None when the period is computed. options is the sorted tuple
+    of the names of the options of the request (ADD, DIVIDE), or None when they are computed.
+    """
+    def __init__(self):
+        self.dependencies_by_variable_name = {}
+        self.entity_key_by_variable_name = {}
+
+    def add(self, variable_name, dependency):
+        self.dependencies_by_variable_name.setdefault(variable_name, set()).add(dependency)
+
+    def find_required_variables(self, variables_name):
+        """Return the names of the given variables and of all the variables they require, transitively.
+
+        Variables that are not in the returned set are dead for these outputs and can be pruned.
+        """
+        required_variables_name = set()
+        pending_variables_name = list(variables_name)
+        while pending_variables_name:
+            variable_name = pending_variables_name.pop()
+            if variable_name in required_variables_name:
+                continue
+            required_variables_name.add(variable_name)
+            pending_variables_name.extend(self.get_inputs_name(variable_name))
+        return required_variables_name
+
+    def get_inputs_name(self, variable_name):
+        return set(
+            dependency.variable_name
+            for dependency in self.dependencies_by_variable_name.get(variable_name, ())
+            )
+
+    def group_by_level(self, variables_name):
+        """Return the variables required by the given ones as successive lists: the variables of each list only
+        require variables of the previous lists, so that the variables of a list can be evaluated in parallel."""
+        level_by_variable_name = {}
+        for variable_name in self.sort_topologically(variables_name):
+            level_by_variable_name[variable_name] = max([
+                level_by_variable_name[input_name] + 1
+                for input_name in self.get_inputs_name(variable_name)
+                if input_name in level_by_variable_name
+                ] or [0])
+        levels = [[] for _ in range(max(level_by_variable_name.itervalues()) + 1)] if level_by_variable_name else []
+        for variable_name, level in sorted(level_by_variable_name.iteritems()):
+            levels[level].append(variable_name)
+        return levels
+
+    def sort_topologically(self, variables_name):
+        """Return the variables required by the given ones, each variable after the variables it requires.
+
+        Cycles (variables requiring themselves through other periods) are broken arbitrarily.
+        """
+        sorted_variables_name = []
+        visited_variables_name = set()
+        for root_variable_name in sorted(variables_name):
+            if root_variable_name in visited_variables_name:
+                continue
+            visited_variables_name.add(root_variable_name)
+            stack = [(root_variable_name, iter(sorted(self.get_inputs_name(root_variable_name))))]
+            while stack:
+                variable_name, inputs_name = stack[-1]
+                for input_name in inputs_name:
+                    if input_name not in visited_variables_name:
+                        visited_variables_name.add(input_name)
+                        stack.append((input_name, iter(sorted(self.get_inputs_name(input_name)))))
+                        break
+                else:
+                    stack.pop()
+                    sorted_variables_name.append(variable_name)
+        return sorted_variables_name
+
+    def update(self, other):
+        for variable_name, dependencies in other.dependencies_by_variable_name.iteritems():
+            self.dependencies_by_variable_name.setdefault(variable_name, set()).update(dependencies)
+        self.entity_key_by_variable_name.update(other.entity_key_by_variable_name)
+
+
+# Static extraction
+
+
+def get_chain(node):
+    """Return the root name and the attributes of a chain like name.attribute1.attribute2, or None."""
+    attributes = []
+    while isinstance(node, ast.Attribute):
+        attributes.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    return node.id, list(reversed(attributes))
+
+
+def get_options(node):
+    """Return the sorted names of the options of a list like [ADD], or None when they are computed."""
+    if not isinstance(node, (ast.List, ast.Tuple)) or not all(isinstance(item, ast.Name) for item in node.elts):
+        return None
+    return tuple(sorted(set(unicode(item.id) for item in node.elts)))
+
+
+BLOCK_FIELDS = ('body', 'finalbody', 'handlers', 'orelse')
+
+
+def iter_statements(statements):
+    """Iterate over statements and the statements of their blocks (including nested functions), in the order of the
+    source."""
+    for statement in statements:
+        yield statement
+        if isinstance(statement, ast.ClassDef):
+            continue
+        for field in BLOCK_FIELDS:
+            children = getattr(statement, field, None)
+            if isinstance(children, list):
+                for child in iter_statements(children):
+                    yield child
+
+
+def walk_statement(statement):
+    """Iterate over the nodes of a statement, without entering its blocks."""
+    for field, value in ast.iter_fields(statement):
+        if field in BLOCK_FIELDS:
+            continue
+        for child in (value if isinstance(value, list) else [value]):
+            if isinstance(child, ast.AST):
+                for node in ast.walk(child):
+                    yield node
+
+
+class FunctionAnalyzer(object):
+    """Extract the inputs requested by a function, and the module functions it calls."""
+    def __init__(self, function_node, variables_name):
+        self.called_functions_name = set()
+        self.dependencies = set()
+        self.variables_name = variables_name
+        arguments_name = [argument.id for argument in function_node.args.args if isinstance(argument, ast.Name)]
+        self.period_transform_by_name = {}
+        if 'period' in arguments_name:
+            self.period_transform_by_name['period'] = u''
+        elif len(arguments_name) >= 2:
+            self.period_transform_by_name[arguments_name[1]] = u''
+
+        for statement in iter_statements(function_node.body):
+            for node in walk_statement(statement):
+                if isinstance(node, ast.Call):
+                    self.visit_call(node)
+            if isinstance(statement, ast.Assign) and len(statement.targets) == 1 \
+                    and isinstance(statement.targets[0], ast.Name):
+                target_name = statement.targets[0].id
+                period_transform = self.get_period_transform(statement.value)
+                if period_transform is not None:
+                    self.period_transform_by_name[target_name] = period_transform
+                else:
+                    self.period_transform_by_name.pop(target_name, None)
+
+    def get_period_transform(self, node):
+        chain = get_chain(node)
+        if chain is None:
+            return None
+        name, attributes = chain
+        period_transform = self.period_transform_by_name.get(name)
+        if period_transform is None:
+            return None
+        return u'.'.join(([period_transform] if period_transform else []) + attributes)
+
+    def visit_call(self, node):
+        chain = get_chain(node.func)
+        if chain is None:
+            return
+        name, attributes = chain
+        if not attributes:
+            self.called_functions_name.add(name)
+        if not node.args or not isinstance(node.args[0], ast.Str) or node.args[0].s not in self.variables_name \
+                or not IGNORED_ATTRIBUTES.isdisjoint(attributes):
+            return
+        period_nodes = node.args[1:2] + [keyword.value for keyword in node.keywords if keyword.arg == 'period']
+        period_transform = self.get_period_transform(period_nodes[0]) if period_nodes else None
+        options_nodes = node.args[2:3] + [keyword.value for keyword in node.keywords if keyword.arg == 'options']
+        options = get_options(options_nodes[0]) if options_nodes else ()
+        self.dependencies.add(Dependency(node.args[0].s, u'.'.join(attributes), period_transform, options))
+
+
+def extract_module_dependencies(module_path, variables_name):
+    """Return the dependencies of the variables defined in a module, by variable name."""
+    with open(module_path) as module_file:
+        module_node = ast.parse(module_file.read(), module_path)
+    analyzer_by_function_name = dict(
+        (node.name, FunctionAnalyzer(node, variables_name))
+        for node in module_node.body
+        if isinstance(node, ast.FunctionDef)
+        )
+
+    def collect_dependencies(analyzers):
+        # Dependencies of the functions, including those of the module functions they call, transitively
+        dependencies = set()
+        visited_functions_name = set()
+        pending_analyzers = list(analyzers)
+        while pending_analyzers:
+            analyzer = pending_analyzers.pop()
+            dependencies.update(analyzer.dependencies)
+            for function_name in analyzer.called_functions_name:
+                if function_name in analyzer_by_function_name and function_name not in visited_functions_name:
+                    visited_functions_name.add(function_name)
+                    pending_analyzers.append(analyzer_by_function_name[function_name])
+        return dependencies
+
+    return dict(
+        (node.name, collect_dependencies(
+            FunctionAnalyzer(function_node, variables_name)
+            for function_node in node.body
+            if isinstance(function_node, ast.FunctionDef)
+            ))
+        for node in module_node.body
+        if isinstance(node, ast.ClassDef) and node.name in variables_name
+        )
+
+
+def iter_model_modules_path():
+    for dir_path, dirs_name, files_name in os.walk(MODEL_DIR):
+        for file_name in sorted(files_name):
+            if file_name.endswith('.py'):
+                yield os.path.join(dir_path, file_name)
+
+
+def extract_static_graph(tax_benefit_system):
+    """Return the dependency graph of the variables of a tax benefit system, extracted from the model modules."""
+    column_by_name = tax_benefit_system.column_by_name
+    variables_name = frozenset(column_by_name)
+    # Inputs of folded stubs are never computed.
+    folded_variables_name = frozenset(getattr(tax_benefit_system, 'folded_constant_by_variable_name', ()))
+    graph = DependencyGraph()
+    for variable_name, column in column_by_name.iteritems():
+        graph.entity_key_by_variable_name[variable_name] = column.entity.key
+    for module_path in iter_model_modules_path():
+        for variable_name, dependencies in extract_module_dependencies(module_path, variables_name).iteritems():
+            if variable_name in folded_variables_name:
+                continue
+            for dependency in dependencies:
+                graph.add(variable_name, dependency)
+    return graph
+
+
+def load_static_graph(tax_benefit_system):
+    """Return the static dependency graph of a tax benefit system, from the on-disk cache when the model modules have
+    not changed."""
+    parts = [repr(os.path.getmtime(__file__.replace('.pyc', '.py')))]
+    parts.extend(sorted(tax_benefit_system.column_by_name))
+    parts.extend(sorted(getattr(tax_benefit_system, 'folded_constant_by_variable_name', ())))
+    for module_path in iter_model_modules_path():
+        parts.append(module_path)
+        with open(module_path, 'rb') as module_file:
+            parts.append(module_file.read())
+    key = cache.make_key(*parts)
+    graph = cache.load(CACHE_NAMESPACE, key)
+    if graph is None:
+        graph = extract_static_graph(tax_benefit_system)
+        cache.dump(CACHE_NAMESPACE, key, graph)
+    return graph
+
+
+# Tracing
+
+
+def describe_period_transform(period, input_period):
+    """Return the dotted path of the period properties turning period into input_period, or None."""
+    if input_period == period:
+        return u''
+    for property_name in ('this_month', 'this_year', 'last_month', 'last_year', 'n_2'):
+        if getattr(period, property_name, None) == input_period:
+            return unicode(property_name)
+    return None
+
+
+def trace_graph(simulation, variables_name, period = None):
+    """Calculate variables with a simulation and return the dependency graph of the calculations it has made.
+
+    Projections are not observable at run time: they are left empty.
+    """
+    graph = DependencyGraph()
+    stack = []
+    options_by_method_name = dict(
+        (method_name, options)
+        for method_name, options in (
+            ('calculate', ()),
+            ('calculate_add', (u'ADD', )),
+            ('calculate_divide', (u'DIVIDE', )),
+            ('compute', ()),
+            ('compute_add', (u'ADD', )),
+            ('compute_divide', (u'DIVIDE', )),
+            )
+        if hasattr(simulation, method_name)
+        )
+    method_names = sorted(options_by_method_name)
+
+    def make_tracing_method(method, options):
+        def tracing_method(variable_name, period = None, **kwargs):
+            if period is None:
+                period = simulation.period
+            if stack and stack[-1][0] != variable_name:
+                caller_name, caller_period = stack[-1]
+                graph.add(caller_name, Dependency(variable_name, u'',
+                    describe_period_transform(caller_period, period), options))
+            stack.append((variable_name, period))
+            try:
+                return method(variable_name, period = period, **kwargs)
+            finally:
+                stack.pop()
+        return tracing_method
+
+    for method_name in method_names:
+        setattr(simulation, method_name, make_tracing_method(getattr(simulation, method_name),
+            options_by_method_name[method_name]))
+    try:
+        for variable_name in variables_name:
+            simulation.calculate(variable_name, period = period)
+    finally:
+        for method_name in method_names:
+            delattr(simulation, method_name)
+    for variable_name in graph.find_required_variables(variables_name):
+        column = simulation.tax_benefit_system.column_by_name.get(variable_name)
+        if column is not None:
+            graph.entity_key_by_variable_name[variable_name] = column.entity.key
+    return graph
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+
+"""Folding of the placeholder formulas of the model, when the tax benefit system is loaded.
+
+Some formulas are stubs waiting for a real implementation: they return a constant, or zero times their inputs, or one
+of their inputs unchanged. The source of each formula is analyzed once: constant formulas are replaced by formulas
+returning a shared read-only constant, without computing their inputs, and identity formulas by aliases, whose holders
+share the array of their input instead of a copy.
+"""
+
+
+import ast
+import inspect
+import textwrap
+
+import numpy as np
+
+
+PERIOD_TRANSFORMS = ('this_month', 'this_year')
+# Functions of their arguments only, that can't turn zero times their result into something else than zero
+PURE_FUNCTIONS_NAME = ('and_', 'not_', 'or_')
+
+
+def parse_function(function):
+    """Return the ast node of the definition of function, or None when its source is not available."""
+    try:
+        source = inspect.getsource(function)
+    except (IOError, TypeError):
+        return None
+    try:
+        module_node = ast.parse(textwrap.dedent(source))
+    except SyntaxError:
+        return None
+    function_node = module_node.body[0] if module_node.body else None
+    return function_node if isinstance(function_node, ast.FunctionDef) else None
+
+
+def get_input_name(node, entity_name, period_name):
+    """Return the name of the variable requested by a call like entity('name', period = period) or
+    entity.members('name', period = period), or None when node is not such a call.
+    """
+    if not isinstance(node, ast.Call) or node.starargs is not None or node.kwargs is not None:
+        return None
+    function = node.func
+    while isinstance(function, ast.Attribute):
+        function = function.value
+    if not isinstance(function, ast.Name) or function.id != entity_name:
+        return None
+    if not node.args or not isinstance(node.args[0], ast.Str) or len(node.args) > 2:
+        return None
+    if any(keyword.arg != 'period' for keyword in node.keywords):
+        return None
+    periods_node = node.args[1:] + [keyword.value for keyword in node.keywords]
+    if len(periods_node) != 1:
+        return None
+    period_node = periods_node[0]
+    if not isinstance(period_node, ast.Name) or period_node.id != period_name:
+        return None
+    return node.args[0].s
+
+
+def is_pure(node, inputs_name):
+    """Return whether node is an arithmetic expression of inputs and numbers."""
+    if isinstance(node, ast.Num):
+        return True
+    if isinstance(node, ast.Name):
+        return node.id in inputs_name
+    if isinstance(node, ast.BinOp):
+        return is_pure(node.left, inputs_name) and is_pure(node.right, inputs_name)
+    if isinstance(node, ast.UnaryOp):
+        return is_pure(node.operand, inputs_name)
+    if isinstance(node, ast.Call):
+        return isinstance(node.func, ast.Name) and node.func.id in PURE_FUNCTIONS_NAME and not node.keywords \
+            and node.starargs is None and node.kwargs is None \
+            and all(is_pure(argument, inputs_name) for argument in node.args)
+    return False
+
+
+def get_constant(node, inputs_name):
+    """Return the value of an expression that doesn't depend on its inputs, or None."""
+    if isinstance(node, ast.Num):
+        return node.n
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        value = get_constant(node.operand, inputs_name)
+        if value is None:
+            return None
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mult):
+        left = get_constant(node.left, inputs_name)
+        right = get_constant(node.right, inputs_name)
+        if left is not None and right is not None:
+            return left * right
+        if left == 0 and is_pure(node.right, inputs_name) or right == 0 and is_pure(node.left, inputs_name):
+            return 0
+    return None
+
+
+def analyze_function(function):
+    """Return the folding of a formula function.
+
+    The folding is either ('constant', value, period_transform) or ('alias', variable_name, period_transform), where
+    period_transform is the name of the period property applied to the requested period (or None). Return None when
+    the formula is neither constant nor an identity. Only inputs requested directly to the entity (not to its members
+    or to one of its roles) can be aliased.
+    """
+    node = parse_function(function)
+    if node is None:
+        return None
+    arguments = node.args
+    if arguments.vararg is not None or arguments.kwarg is not None or arguments.defaults \
+            or len(arguments.args) < 2 or not all(isinstance(argument, ast.Name) for argument in arguments.args):
+        return None
+    entity_name = arguments.args[0].id
+    period_name = arguments.args[1].id
+
+    statements = node.body
+    if isinstance(statements[0], ast.Expr) and isinstance(statements[0].value, ast.Str):
+        # Docstring
+        statements = statements[1:]
+    if not statements:
+        return None
+    period_transform = None
+    input_name_by_name = {}
+    direct_inputs_name = set()
+    for statement in statements[:-1]:
+        if not isinstance(statement, ast.Assign) or len(statement.targets) != 1 \
+                or not isinstance(statement.targets[0], ast.Name):
+            return None
+        target_name = statement.targets[0].id
+        value = statement.value
+        if target_name == period_name:
+            if period_transform is not None or input_name_by_name or not isinstance(value, ast.Attribute) \
+                    or not isinstance(value.value, ast.Name) or value.value.id != period_name \
+                    or value.attr not in PERIOD_TRANSFORMS:
+                return None
+            period_transform = value.attr
+            continue
+        input_name = get_input_name(value, entity_name, period_name)
+        if input_name is None or target_name in input_name_by_name or target_name == entity_name:
+            return None
+        input_name_by_name[target_name] = input_name
+        if isinstance(value.func, ast.Name):
+            direct_inputs_name.add(target_name)
+
+    returned = statements[-1]
+    if not isinstance(returned, ast.Return) or not isinstance(returned.value, ast.Tuple) \
+            or len(returned.value.elts) != 2:
+        return None
+    returned_period, expression = returned.value.elts
+    if not isinstance(returned_period, ast.Name) or returned_period.id != period_name:
+        return None
+    value = get_constant(expression, input_name_by_name)
+    if value is not None:
+        return 'constant', value, period_transform
+    if isinstance(expression, ast.Name) and expression.id in direct_inputs_name:
+        return 'alias', input_name_by_name[expression.id], period_transform
+    return None
+
+
+def get_broadcast_constant(entity, variable_name, value):
+    """Return a read-only array of value for each member of entity, sharing a single item of memory.
+
+    Folded arrays are zero-stride views: any in-place operation on them (+=, item assignment...) raises a ValueError.
+    Formulas using them must build new arrays.
+    """
+    column = entity.simulation.tax_benefit_system.column_by_name[variable_name]
+    return np.broadcast_to(np.array(value, dtype = column.dtype), (entity.count,))
+
+
+def get_alias_array(entity, variable_name, input_name, period):
+    """Return the array of the input of an alias, itself when it has the dtype of the alias.
+
+    The holders of the alias and of its input then share the same array: in-place operations on one change the
+    other.
+    """
+    array = entity(input_name, period = period)
+    dtype = entity.simulation.tax_benefit_system.column_by_name[variable_name].dtype
+    return array if array.dtype == dtype else array.astype(dtype)
+
+
+def make_formula_function(folded_function, period_transform, arguments_count):
+    def transforming_function(entity, period):
+        if period_transform is not None:
+            period = getattr(period, period_transform)
+        return period, folded_function(entity, period)
+
+    # Formulas are called according to the arguments of their function: keep the same ones.
+    if arguments_count == 2:
+        def function(entity, period):
+            return transforming_function(entity, period)
+    else:
+        def function(entity, period, legislation):
+            return transforming_function(entity, period)
+    function.__name__ = 'function'
+    return function
+
+
+def make_constant_function(variable_name, value, period_transform, arguments_count):
+    return make_formula_function(lambda entity, period: get_broadcast_constant(entity, variable_name, value),
+        period_transform, arguments_count)
+
+
+def make_alias_function(variable_name, input_name, period_transform, arguments_count):
+    return make_formula_function(lambda entity, period: get_alias_array(entity, variable_name, input_name, period),
+        period_transform, arguments_count)
+
+
+def fold_variable(variable):
+    """Return the folding of the formula of a variable class (see analyze_function), with the variable class to use
+    instead of it, or None when the formula can't be folded.
+    """
+    function = variable.__dict__.get('function')
+    if function is None:
+        return None
+    folding = analyze_function(function)
+    if folding is None:
+        return None
+    kind, value, period_transform = folding
+    make_function = make_constant_function if kind == 'constant' else make_alias_function
+    attributes = dict(
+        (name, attribute)
+        for name, attribute in variable.__dict__.iteritems()
+        if name not in ('__dict__', '__weakref__')
+        )
+    attributes['function'] = make_function(variable.__name__, value, period_transform, function.func_code.co_argcount)
+    return folding, type(variable.__name__, variable.__bases__, attributes)
@@ -2,6 +2,9 @@
 
 
 from datetime import date
+import weakref
+
+import numpy as np
 
 from openfisca_core.columns import (AgeCol, BoolCol, DateCol, EnumCol, FloatCol, IntCol,
     PeriodSizeIndependentIntCol, StrCol)
@@ -22,13 +25,22 @@ __all__ = [
     'DateCol',
     'dated_function',
     'DatedVariable',
+    'enable_monthly_batches',
     'Enum',
     'EnumCol',
     'FloatCol',
     'FoyerFiscal',
+    'get_members_index_matrix',
+    'group_argmin',
+    'group_count',
+    'group_max',
+    'group_min',
+    'has_nonzero_input',
     'Individu',
     'IntCol',
     'Menage',
+    'members_matrix',
+    'monthly_batched_simulations',
     'PAC1',
     'PAC2',
     'PAC3',
@@ -51,3 +63,162 @@ PAC2 = QUIFOY['pac2']
 PAC3 = QUIFOY['pac3']
 PREF = QUIMEN['pref']
 VOUS = QUIFOY['vous']
+
+
+# Dense matrices of the members of group entities
+
+
+# Index matrices by roles, with the members_entity_id array they were computed from, by entity
+index_matrix_by_roles_by_entity = weakref.WeakKeyDictionary()
+
+
+def get_members_index_matrix(entity, roles = None):
+    """Return a (entities × places) matrix of the indexes of the members of each entity, -1 for empty places.
+
+    Members are ordered by legacy role (and by index for the same legacy role). When roles is given, only the members
+    having one of these roles are kept. Memberships don't depend on the period, so matrices are cached by entity.
+    """
+    if roles is not None:
+        roles = tuple(roles)
+    members_entity_id, index_matrix_by_roles = index_matrix_by_roles_by_entity.get(entity, (None, None))
+    if members_entity_id is not entity.members_entity_id:
+        members_entity_id = entity.members_entity_id
+        index_matrix_by_roles = {}
+        index_matrix_by_roles_by_entity[entity] = (members_entity_id, index_matrix_by_roles)
+    index_matrix = index_matrix_by_roles.get(roles)
+    if index_matrix is None:
+        members_index = np.arange(len(members_entity_id))
+        if roles is not None:
+            members_role = entity.members_role
+            members_index = members_index[np.logical_or.reduce([members_role == role for role in roles])]
+        order = np.lexsort((members_index, entity.members_legacy_role[members_index],
+            members_entity_id[members_index]))
+        members_index = members_index[order]
+        sorted_entity_id = members_entity_id[members_index]
+        # Place of each member in its entity: distance to the first member of the entity
+        place = np.arange(len(members_index)) - np.searchsorted(sorted_entity_id, sorted_entity_id)
+        index_matrix = -np.ones((entity.count, place.max() + 1 if len(place) else 1), dtype = np.int32)
+        index_matrix[sorted_entity_id, place] = members_index
+        index_matrix_by_roles[roles] = index_matrix
+    return index_matrix
+
+
+def members_matrix(entity, array, roles = None, fill_value = 0):
+    """Gather an array of individus into a (entities × places) matrix, filled with fill_value for empty places."""
+    index_matrix = get_members_index_matrix(entity, roles = roles)
+    matrix = array[index_matrix]
+    matrix[index_matrix < 0] = fill_value
+    return matrix
+
+
+# Reductions of individus arrays by group entity
+
+
+def sort_by_group(entity, where = None):
+    """Return the indexes of the members (those where where is true, when given) sorted by entity, their entity ids and
+    the positions where each entity starts in them."""
+    members_entity_id = entity.members_entity_id
+    members_index = np.arange(len(members_entity_id)) if where is None else np.flatnonzero(where)
+    entity_id = members_entity_id[members_index]
+    if len(entity_id) > 1 and (entity_id[1:] < entity_id[:-1]).any():
+        order = entity_id.argsort(kind = 'mergesort')
+        members_index = members_index[order]
+        entity_id = entity_id[order]
+    starts = np.flatnonzero(np.concatenate(([True], entity_id[1:] != entity_id[:-1]))) if len(entity_id) else \
+        np.zeros(0, dtype = int)
+    return members_index, entity_id, starts
+
+
+def group_reduce(ufunc, entity, values, empty_value, where = None):
+    members_index, entity_id, starts = sort_by_group(entity, where = where)
+    result = np.empty(entity.count, dtype = values.dtype)
+    result.fill(empty_value)
+    if len(starts):
+        result[entity_id[starts]] = ufunc.reduceat(values[members_index], starts)
+    return result
+
+
+def group_min(entity, values, empty_value, where = None):
+    """Return the minimum of values over the members of each entity, or empty_value for entities without member."""
+    return group_reduce(np.minimum, entity, values, empty_value, where = where)
+
+
+def group_max(entity, values, empty_value, where = None):
+    """Return the maximum of values over the members of each entity, or empty_value for entities without member."""
+    return group_reduce(np.maximum, entity, values, empty_value, where = where)
+
+
+def group_argmin(entity, values, where = None):
+    """Return the index of the member having the minimum value in each entity (the first one in case of tie), or -1
+    for entities without member."""
+    members_index = np.arange(len(values)) if where is None else np.flatnonzero(where)
+    entity_id = entity.members_entity_id[members_index]
+    order = np.lexsort((members_index, values[members_index], entity_id))
+    members_index = members_index[order]
+    entity_id = entity_id[order]
+    result = -np.ones(entity.count, dtype = np.int32)
+    if len(entity_id):
+        is_first = np.concatenate(([True], entity_id[1:] != entity_id[:-1]))
+        result[entity_id[is_first]] = members_index[is_first]
+    return result
+
+
+def group_count(entity, where = None):
+    """Return the number of members of each entity (of those where where is true, when given)."""
+    members_entity_id = entity.members_entity_id
+    if where is not None:
+        members_entity_id = members_entity_id[where]
+    return np.bincount(members_entity_id, minlength = entity.count)
+
+
+# Inputs
+
+
+def is_input_variable(column):
+    """Return whether a column has no formula. In OpenFisca-Core 4, the formula class of input columns has no
+    function."""
+    formula_class = column.formula_class
+    return formula_class is None or getattr(formula_class, 'function', True) is None
+
+
+def has_nonzero_input(entity, variables_name, period):
+    """Return whether one of the given input variables of entity has a nonzero value for period.
+
+    Input variables that have not been set hold their default value, and are not even read. Formulas whose inputs are
+    all zero (most of the non-salary incomes of most foyers) can then return zeros without computing anything. A
+    variable having a formula is always considered as nonzero. Inputs of individus are given with entity.members.
+    """
+    simulation = entity.simulation
+    column_by_name = simulation.tax_benefit_system.column_by_name
+    for variable_name in variables_name:
+        column = column_by_name[variable_name]
+        assert column.entity.key == entity.key, u'Variable {} belongs to {}, not to {}'.format(variable_name,
+            column.entity.key, entity.key).encode('utf-8')
+        if not is_input_variable(column):
+            return True
+        holder = simulation.holder_by_name.get(variable_name)
+        array = holder.get_array(period) if holder is not None else None
+        if array is None:
+            if column.default:
+                return True
+        elif array.any():
+            return True
+    return False
+
+
+# Monthly batches
+
+
+# Simulations whose yearly social contributions are calculated month by month, the 12 months in a single pass
+monthly_batched_simulations = weakref.WeakSet()
+
+
+def enable_monthly_batches(simulation):
+    """Calculate the yearly social contributions of a simulation month by month, the 12 months in a single pass.
+
+    Monthly contributions are cached, so later monthly requests don't run any contribution formula. Years whose
+    barèmes change between months are still calculated yearly, with the barèmes of their start, since the sum of their
+    monthly contributions would differ. Model modules are loaded from their files by the tax benefit system: this state
+    lives here, in a module imported by package, to be shared with the tests.
+    """
+    monthly_batched_simulations.add(simulation)
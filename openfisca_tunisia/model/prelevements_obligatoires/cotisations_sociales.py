@@ -3,36 +3,203 @@
 
 from __future__ import division
 
-from numpy import zeros
+import weakref
+
+from numpy import array, array_equal, inf, maximum as max_, minimum as min_, newaxis, ones, where, zeros
 
 from openfisca_tunisia.model.base import *  # noqa analysis:ignore
 from openfisca_tunisia.model.data import CAT
 
 
-def compute_cotisation(individu, period, cotisation_type = None, bareme_name = None, legislation = None):
-    assert cotisation_type in ['employeur', 'salarie']
+COTISATION_TYPES = ['employeur', 'salarie']
+BAREME_NAMES = [
+    'accident_du_travail',
+    'deces',
+    'famille',
+    'fonds_special_etat',
+    'maladie',
+    'maternite',
+    'protection_sociale_travailleurs',
+    'retraite',
+    ]
+BAREMES_ASSURANCES_SOCIALES = ['maladie', 'maternite', 'deces']
+COTISATION_KEYS = [
+    (cotisation_type, bareme_name)
+    for cotisation_type in COTISATION_TYPES
+    for bareme_name in BAREME_NAMES
+    ]
+
+# Barèmes compilés, par nœud de législation datée (donc par instant)
+compiled_baremes_by_legislation = weakref.WeakKeyDictionary()
+# Cotisations déjà calculées, par simulation puis par période
+cotisations_by_simulation = weakref.WeakKeyDictionary()
+
+
+def get_bareme(baremes_by_regime, regime_name, cotisation_type, bareme_name):
+    bareme_by_name = baremes_by_regime[regime_name].get('cotisations_{}'.format(cotisation_type))
+    if bareme_by_name is None:
+        return None
+    if bareme_name in BAREMES_ASSURANCES_SOCIALES:
+        baremes_assurances_sociales = bareme_by_name.get('assurances_sociales')
+        if baremes_assurances_sociales is not None:
+            return baremes_assurances_sociales.get(bareme_name)
+    return bareme_by_name.get(bareme_name)
+
+
+def compile_baremes(baremes_by_regime):
+    '''
+    Compile les barèmes de cotisation d'une législation datée en tableaux indexés par
+    (indice du régime, indice de la cotisation, tranche).
+
+    Renvoie les seuils bas, les seuils hauts et les taux des tranches, ainsi que la liste des indices de
+    cotisation définis dans au moins un régime. Un régime sans barème pour une cotisation a des seuils infinis et
+    des taux nuls, comme la dernière ligne, réservée aux catégories de salarié inconnues (voir get_regime_indexes).
+    '''
+    bareme_by_index = {}
+    brackets_count = 1
+    for regime_name, regime_index in CAT:
+        for key_index, (cotisation_type, bareme_name) in enumerate(COTISATION_KEYS):
+            bareme = get_bareme(baremes_by_regime, regime_name, cotisation_type, bareme_name)
+            if bareme is None or not bareme.thresholds:
+                continue
+            bareme_by_index[(regime_index, key_index)] = bareme
+            brackets_count = max(brackets_count, len(bareme.thresholds))
+
+    regimes_count = max(regime_index for _, regime_index in CAT) + 1
+    shape = (regimes_count + 1, len(COTISATION_KEYS), brackets_count)
+    lower_thresholds = inf * ones(shape)
+    upper_thresholds = inf * ones(shape)
+    rates = zeros(shape)
+    for (regime_index, key_index), bareme in bareme_by_index.iteritems():
+        brackets = len(bareme.thresholds)
+        lower_thresholds[regime_index, key_index, :brackets] = bareme.thresholds
+        upper_thresholds[regime_index, key_index, :brackets - 1] = bareme.thresholds[1:]
+        rates[regime_index, key_index, :brackets] = bareme.rates
+    defined_key_indexes = sorted(set(key_index for _, key_index in bareme_by_index))
+    return lower_thresholds, upper_thresholds, rates, defined_key_indexes
+
+
+def get_compiled_baremes(baremes_by_regime):
+    compiled_baremes = compiled_baremes_by_legislation.get(baremes_by_regime)
+    if compiled_baremes is None:
+        compiled_baremes = compiled_baremes_by_legislation[baremes_by_regime] = compile_baremes(baremes_by_regime)
+    return compiled_baremes
+
+
+def get_regime_indexes(categorie_salarie, compiled_baremes):
+    '''
+    Renvoie l'indice de régime de chaque catégorie de salarié dans les barèmes compilés : la ligne nulle (la
+    dernière) pour les catégories hors de 0..len(CAT) - 1, qui ne cotisent pas.
+    '''
+    unknown_index = len(compiled_baremes[0]) - 1
+    return where((categorie_salarie >= 0) * (categorie_salarie < unknown_index), categorie_salarie, unknown_index)
+
+
+def get_cotisation_variable_name(cotisation_type, bareme_name):
+    if bareme_name == 'fonds_special_etat':
+        return bareme_name if cotisation_type == 'employeur' else None
+    return '{}_{}'.format(bareme_name, cotisation_type)
+
+
+def are_same_compiled_baremes(compiled_baremes, other_compiled_baremes):
+    return all(
+        array_equal(table, other_table)
+        for table, other_table in zip(compiled_baremes[:3], other_compiled_baremes[:3])
+        ) and compiled_baremes[3] == other_compiled_baremes[3]
+
+
+def compute_cotisations_by_month(individu, year, assiette_annuelle, categorie_salarie, legislation):
+    '''
+    Calcule les cotisations des 12 mois de l'année sur des tableaux (mois × individus), avec les barèmes de l'année.
+
+    L'assiette d'un individu sans assiette mensuelle est répartie également entre les mois. Les cotisations de chaque
+    mois sont mises en cache dans les holders des variables de cotisation. Renvoie les cotisations annuelles, indexées
+    par (cotisation_type, bareme_name), ou None quand les barèmes changent en cours d'année : les cotisations
+    mensuelles, calculées avec les barèmes de leur mois, ne se somment alors pas en cotisations annuelles, calculées
+    avec ceux du début de l'année.
+    '''
+    months = [year.start.offset(index, 'month').period('month') for index in range(12)]
+    compiled_baremes = get_compiled_baremes(legislation(year.start).cotisations_sociales)
+    for month in months[1:]:
+        if not are_same_compiled_baremes(compiled_baremes,
+                get_compiled_baremes(legislation(month.start).cotisations_sociales)):
+            return None
+    lower_thresholds, upper_thresholds, rates, defined_key_indexes = compiled_baremes
+    regime_indexes = get_regime_indexes(categorie_salarie, compiled_baremes)
+
+    assiettes = array([individu('assiette_cotisations_sociales', month) for month in months])
+    assiettes = where((assiettes != 0).any(axis = 0), assiettes, assiette_annuelle / 12)
+
+    simulation = individu.simulation
+    column_by_name = simulation.tax_benefit_system.column_by_name
+    assiettes = assiettes[:, :, newaxis]
+    cotisation_by_key = dict((key, zeros(len(assiette_annuelle))) for key in COTISATION_KEYS)
+    for key_index in defined_key_indexes:
+        # Tranches (mois × individu × tranche) du barème de chaque individu, selon son régime
+        tranches = max_(
+            min_(assiettes, upper_thresholds[regime_indexes, key_index]) - lower_thresholds[regime_indexes, key_index],
+            0,
+            )
+        cotisations = - (rates[regime_indexes, key_index] * tranches).sum(axis = 2)
+        key = COTISATION_KEYS[key_index]
+        cotisation_by_key[key] = cotisations.sum(axis = 0)
+        variable_name = get_cotisation_variable_name(*key)
+        if variable_name in column_by_name:
+            holder = simulation.get_or_new_holder(variable_name)
+            for month, cotisation in zip(months, cotisations):
+                holder.put_in_cache(cotisation, month)
+    return cotisation_by_key
+
+
+def compute_cotisations(individu, period, legislation = None):
+    '''
+    Calcule en une seule passe toutes les cotisations employeur et salarié de tous les régimes.
+
+    Les barèmes sont lus dans des tableaux compilés une fois par législation datée et indexés par la catégorie de
+    salarié, sans parcourir l'arbre de la législation. Le résultat est un dictionnaire indexé par
+    (cotisation_type, bareme_name), mis en cache pour la simulation et la période afin que toutes les variables de
+    cotisation le partagent.
+    '''
     assiette_cotisations_sociales = individu('assiette_cotisations_sociales', period)
     categorie_salarie = individu('categorie_salarie', period)  # TODO change to regime_salarie
-    baremes_by_regime = legislation(period.start).cotisations_sociales
-    cotisation = zeros(len(assiette_cotisations_sociales))
-    for regime_name, regime_index in CAT:
-        bareme_by_name = baremes_by_regime[regime_name].get(
-            'cotisations_{}'.format(cotisation_type))
-        if bareme_by_name is not None:
-            if bareme_name in ['maladie', 'maternite', 'deces']:
-                baremes_assurances_sociales = bareme_by_name.get('assurances_sociales')
-                if baremes_assurances_sociales is not None:
-                    bareme = baremes_assurances_sociales.get(bareme_name)
-                else:
-                    bareme = bareme_by_name.get(bareme_name)
-            else:
-                bareme = bareme_by_name.get(bareme_name)
-
-            if bareme is not None:
-                cotisation += bareme.calc(
-                    assiette_cotisations_sociales * (categorie_salarie == regime_index),
-                    )
-    return - cotisation
+
+    cotisation_by_key_by_period = cotisations_by_simulation.setdefault(individu.simulation, {})
+    cached = cotisation_by_key_by_period.get(period)
+    # Les tableaux d'entrée sont comparés par identité : s'ils ont été recalculés, le cache est périmé.
+    if cached is not None and cached[0] is assiette_cotisations_sociales and cached[1] is categorie_salarie:
+        return cached[2]
+
+    if period.unit == 'year' and period.size == 1 and individu.simulation in monthly_batched_simulations:
+        cotisation_by_key = compute_cotisations_by_month(individu, period, assiette_cotisations_sociales,
+            categorie_salarie, legislation)
+        if cotisation_by_key is not None:
+            cotisation_by_key_by_period[period] = (assiette_cotisations_sociales, categorie_salarie,
+                cotisation_by_key)
+            return cotisation_by_key
+
+    compiled_baremes = get_compiled_baremes(legislation(period.start).cotisations_sociales)
+    lower_thresholds, upper_thresholds, rates, defined_key_indexes = compiled_baremes
+    regime_indexes = get_regime_indexes(categorie_salarie, compiled_baremes)
+    count = len(assiette_cotisations_sociales)
+    cotisation_by_key = dict((key, zeros(count)) for key in COTISATION_KEYS)
+    assiette = assiette_cotisations_sociales[:, newaxis]
+    for key_index in defined_key_indexes:
+        # Tranches (individu × tranche) du barème de chaque individu, selon son régime
+        tranches = max_(
+            min_(assiette, upper_thresholds[regime_indexes, key_index]) -
+            lower_thresholds[regime_indexes, key_index],
+            0,
+            )
+        cotisation_by_key[COTISATION_KEYS[key_index]] = - (rates[regime_indexes, key_index] * tranches).sum(axis = 1)
+
+    cotisation_by_key_by_period[period] = (assiette_cotisations_sociales, categorie_salarie, cotisation_by_key)
+    return cotisation_by_key
+
+
+def compute_cotisation(individu, period, cotisation_type = None, bareme_name = None, legislation = None):
+    assert cotisation_type in COTISATION_TYPES
+    assert bareme_name in BAREME_NAMES
+    return compute_cotisations(individu, period, legislation = legislation)[(cotisation_type, bareme_name)]
 
 
 class assiette_cotisations_sociales(Variable):
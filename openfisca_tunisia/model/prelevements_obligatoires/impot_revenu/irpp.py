@@ -3,7 +3,7 @@
 
 from __future__ import division
 
-from numpy import logical_or as or_, maximum as max_, minimum as min_
+from numpy import logical_or as or_, maximum as max_, minimum as min_, zeros
 
 from openfisca_tunisia.model.base import *  # noqa analysis:ignore
 
@@ -126,7 +126,9 @@ class bic(Variable):
 
     def function(foyer_fiscal, period):
         period = period.this_year
-        bic_reel_res = foyer_fiscal('bic_reel_res', period = period)
+        if not has_nonzero_input(foyer_fiscal.members, ['bic_reel_res'], period):
+            return period, zeros(foyer_fiscal.count)
+        bic_reel_res = foyer_fiscal.sum(foyer_fiscal.members('bic_reel_res', period = period))
         # TODO:
         #    return period, bic_reel + bic_simpl + bic_forf
         return period, bic_reel_res
@@ -188,6 +190,10 @@ def _bic_res_net(bic_benef_fiscal_cession, bic_part_benef_sp):
 
 
 # 2. Bénéfices des professions non commerciales
+
+BNC_INPUTS = ['bnc_forf_rec_brut', 'bnc_part_benef_sp', 'bnc_reel_res_fiscal']
+
+
 class bnc(Variable):
     column = FloatCol
     entity = FoyerFiscal
@@ -195,9 +201,11 @@ class bnc(Variable):
 
     def function(foyer_fiscal, period):
         period = period.this_year
-        bnc_reel_res_fiscal = foyer_fiscal('bnc_reel_res_fiscal', period = period)
-        bnc_forf_benef_fiscal = foyer_fiscal('bnc_forf_benef_fiscal', period = period)
-        bnc_part_benef_sp = foyer_fiscal('bnc_part_benef_sp', period = period)
+        if not has_nonzero_input(foyer_fiscal.members, BNC_INPUTS, period):
+            return period, zeros(foyer_fiscal.count)
+        bnc_reel_res_fiscal = foyer_fiscal.sum(foyer_fiscal.members('bnc_reel_res_fiscal', period = period))
+        bnc_forf_benef_fiscal = foyer_fiscal.sum(foyer_fiscal.members('bnc_forf_benef_fiscal', period = period))
+        bnc_part_benef_sp = foyer_fiscal.sum(foyer_fiscal.members('bnc_part_benef_sp', period = period))
 
         return period, bnc_reel_res_fiscal + bnc_forf_benef_fiscal + bnc_part_benef_sp
 
@@ -207,17 +215,23 @@ class bnc_forf_benef_fiscal(Variable):
     entity = Individu
     label = u"Bénéfice fiscal (régime forfaitaire en % des recettes brutes TTC)"
 
-    def function(foyer_fiscal, period, legislation):
+    def function(individu, period, legislation):
         """
         Bénéfice fiscal (régime forfaitaire, 70% des recettes brutes TTC)
         """
         period = period.this_year
-        bnc_forf_rec_brut = foyer_fiscal('bnc_forf_rec_brut', period = period)
+        if not has_nonzero_input(individu, ['bnc_forf_rec_brut'], period):
+            return period, zeros(individu.count)
+        bnc_forf_rec_brut = individu('bnc_forf_rec_brut', period = period)
         part = legislation(period.start).impot_revenu.bnc.forf.part_forf
         return period, bnc_forf_rec_brut * part
 
 
 # 3. Bénéfices de l'exploitation agricole et de pêche
+
+BEAP_INPUTS = ['beap_monogr', 'beap_part_benef_sp', 'beap_reel_res_fiscal', 'beap_reliq_benef_fiscal']
+
+
 class beap(Variable):
     column = FloatCol
     entity = FoyerFiscal
@@ -225,16 +239,21 @@ class beap(Variable):
 
     def function(foyer_fiscal, period):
         period = period.this_year
-        beap_reel_res_fiscal = foyer_fiscal('beap_reel_res_fiscal', period = period)
-        beap_reliq_benef_fiscal = foyer_fiscal('beap_reliq_benef_fiscal', period = period)
-        beap_monogr = foyer_fiscal('beap_monogr', period = period)
-        beap_part_benef_sp = foyer_fiscal('beap_part_benef_sp', period = period)
+        if not has_nonzero_input(foyer_fiscal.members, BEAP_INPUTS, period):
+            return period, zeros(foyer_fiscal.count)
+        beap_reel_res_fiscal = foyer_fiscal.sum(foyer_fiscal.members('beap_reel_res_fiscal', period = period))
+        beap_reliq_benef_fiscal = foyer_fiscal.sum(foyer_fiscal.members('beap_reliq_benef_fiscal', period = period))
+        beap_monogr = foyer_fiscal.sum(foyer_fiscal.members('beap_monogr', period = period))
+        beap_part_benef_sp = foyer_fiscal.sum(foyer_fiscal.members('beap_part_benef_sp', period = period))
 
         return period, beap_reel_res_fiscal + beap_reliq_benef_fiscal + beap_monogr + beap_part_benef_sp
 
 
 # 4. Revenus fonciers
 
+FON_FORF_BATI_INPUTS = ['fon_forf_bati_fra', 'fon_forf_bati_rec', 'fon_forf_bati_rel', 'fon_forf_bati_tax']
+
+
 class revenus_fonciers(Variable):
     column = FloatCol
     entity = FoyerFiscal
@@ -257,6 +276,8 @@ class fon_forf_bati(Variable):
 
     def function(foyer_fiscal, period, legislation):
         period = period.this_year
+        if not has_nonzero_input(foyer_fiscal.members, FON_FORF_BATI_INPUTS, period):
+            return period, zeros(foyer_fiscal.count)
         fon_forf_bati_rec = foyer_fiscal.declarant_principal('fon_forf_bati_rec', period = period)
         fon_forf_bati_rel = foyer_fiscal.declarant_principal('fon_forf_bati_rel', period = period)
         fon_forf_bati_fra = foyer_fiscal.declarant_principal('fon_forf_bati_fra', period = period)
@@ -275,6 +296,9 @@ class fon_forf_nbat(Variable):
 
     def function(foyer_fiscal, period):
         period = period.this_year
+        # Revenu nul en l'absence de recettes
+        if not has_nonzero_input(foyer_fiscal.members, ['fon_forf_nbat_rec'], period):
+            return period, zeros(foyer_fiscal.count)
         fon_forf_nbat_rec = foyer_fiscal.declarant_principal('fon_forf_nbat_rec', period = period)
         fon_forf_nbat_dep = foyer_fiscal.declarant_principal('fon_forf_nbat_dep', period = period)
         fon_forf_nbat_tax = foyer_fiscal.declarant_principal('fon_forf_nbat_tax', period = period)
@@ -360,6 +384,10 @@ class revenu_assimile_pension_apres_abattements(Variable):
 
 # 6. Revenus de valeurs mobilières et de capitaux mobiliers
 
+CAPM_INPUTS = ['capm_aut', 'capm_banq', 'capm_caisse', 'capm_cent', 'capm_caut', 'capm_epinv', 'capm_oblig',
+    'capm_part', 'capm_plfcc']
+
+
 class rvcm(Variable):
     column = FloatCol
     entity = FoyerFiscal
@@ -367,6 +395,8 @@ class rvcm(Variable):
 
     def function(foyer_fiscal, period):
         period = period.this_year
+        if not has_nonzero_input(foyer_fiscal.members, CAPM_INPUTS, period):
+            return period, zeros(foyer_fiscal.count)
         capm_banq = foyer_fiscal.declarant_principal('capm_banq', period = period)
         capm_cent = foyer_fiscal.declarant_principal('capm_cent', period = period)
         capm_caut = foyer_fiscal.declarant_principal('capm_caut', period = period)
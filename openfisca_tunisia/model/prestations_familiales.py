@@ -4,8 +4,8 @@
 from __future__ import division
 
 from numpy import (
-    round, zeros, maximum as max_, minimum as min_, logical_xor as xor_, logical_not as not_,
-    asanyarray, amin, amax, arange)
+    round, zeros, minimum as min_,
+    array, asanyarray, datetime64, partition, sort, where)
 
 from openfisca_tunisia.model.base import *  # noqa analysis:ignore
 
@@ -17,57 +17,115 @@ PACS = [QUIMEN['enf' + str(i)] for i in range(1, 10)]
 ENFS = [QUIMEN['enf' + str(i)] for i in range(1, 10)]
 
 
-def age_en_mois_benjamin(age_en_mois):
+def age_en_mois_benjamin(menage, age_en_mois):
     '''
-    Renvoi un vecteur (une entree pour chaque famille) avec l'age du benjamin.
+    Renvoi un vecteur (une entree pour chaque ménage) avec l'age du benjamin, 12 * 9999 en l'absence d'enfant
     '''
-    age_en_mois_benjamin = 12 * 9999
-    for age_en_mois in age_en_moiss.itervalues():
-        isbenjamin = (age_en_mois < age_en_mois_benjamin) * (age_en_mois >= 0)
-        age_en_mois_benjamin = isbenjamin * age_en_mois + \
-            not_(isbenjamin) * age_en_mois_benjamin
-    return age_en_mois_benjamin
+    is_enfant = menage.members_role == Menage.ENFANT
+    return group_min(menage, age_en_mois, 12 * 9999, where = is_enfant * (age_en_mois >= 0))
 
 
-def age_min(age, minimal_age=None):
+def age_min(entity, age, minimal_age=None, where=None):
     '''
-    Returns minimal age higher than or equal to a
+    Returns minimal age higher than or equal to minimal_age of the members of each entity, 9999 if none
     '''
     if minimal_age is None:
         minimal_age = 0
-    ages = asanyarray(age)
-    ages = ages + (ages < minimal_age) * 9999
-    return amin(ages, axis=1)
+    where = age >= minimal_age if where is None else where * (age >= minimal_age)
+    return group_min(entity, age, 9999, where = where)
 
 
-def age_max(age):
+def age_max(entity, age, where=None):
     '''
-    Returns minimal age higher than or equal to a
+    Returns maximal age of the members of each entity, -9999 if none
     '''
-    ages = asanyarray(age)
-    return amax(ages, axis=1)
+    return group_max(entity, age, -9999, where = where)
 
 
-def ages_first_kids(age, nb=None):
+def ages_first_kids(ages, nb=None):
     '''
-    Returns the ages of the nb first born kids according to age
+    Returns the ages of the nb first born kids of each row of ages (one row per menage, one column per child place),
+    from the eldest to the youngest
     '''
-    ages = asanyarray(age.values())
+    if nb is None:
+        nb = 4  # Jusqu'au 4e enfant, qui en bénéficiait en 1989
+    ages = asanyarray(ages)
+    if ages.shape[1] > nb:
+        # Sélection partielle des nb plus grands âges, sans trier toute la matrice
+        ages = -partition(-ages, nb - 1, axis = 1)[:, :nb]
+    return -sort(-ages, axis = 1)
 
-    ages = (ages.T + .00001 * arange(ages.shape[0])).T  # To deal with twins
 
-    if nb is None:
-        nb = 3  # TODO: 4e enfant qui en bénéficiait en 1989
-    i = 0
-    age_list = []
+def trimestre_index(period):
+    '''
+    Returns the index (0 to 3) of the calendar quarter covered by period, or None when period is not a quarter
+    '''
+    start = period.start
+    if period.unit == 'month' and period.size == 3 and start.day == 1 and start.month % 3 == 1:
+        return (start.month - 1) // 3
+    return None
+
+
+def trimestres(year):
+    '''
+    Returns the 4 quarters of year
+    '''
+    return [year.start.offset(3 * index, 'month').period('month', 3) for index in range(4)]
+
 
-    while i < 4:
-        from numpy import putmask
-        maximas = amax(ages, axis=0)
-        age_list.append(round(maximas))
-        putmask(ages, ages == maximas, -99999)
-        i += 1
-    return age_list
+SALAIRES_MENSUELS_INPUTS = ['salaire_de_base', 'primes']
+
+
+def salaires_trimestriels_parents(menage, year):
+    '''
+    Returns the quarterly salaries (quarters × menages × parents) of the personne de référence and the conjoint of
+    each menage, summed from their monthly salaries. The yearly salary is split evenly between quarters for individus
+    without monthly salary input.
+    '''
+    individu = menage.members
+    months = [year.start.offset(index, 'month').period('month') for index in range(12)]
+    salaire_annuel = individu('salaire_imposable', period = year)
+    salaires_trimestriels = (salaire_annuel / 4)[None, :].repeat(4, axis = 0)
+    # Le salaire imposable mensuel dérivé d'un salaire annuel n'est pas nul (cotisation UGTT des agents de la CNRPS) :
+    # les salaires mensuels sont détectés sur les entrées.
+    months_with_input = [
+        month
+        for month in months
+        if has_nonzero_input(individu, SALAIRES_MENSUELS_INPUTS, month)
+        ]
+    if months_with_input:
+        has_salaires_mensuels = zeros(individu.count, dtype = bool)
+        for month in months_with_input:
+            for variable_name in SALAIRES_MENSUELS_INPUTS:
+                has_salaires_mensuels |= individu(variable_name, period = month) != 0
+        salaires_mensuels = array([
+            individu('salaire_imposable', period = month)
+            for month in months
+            ])
+        salaires_trimestriels = where(has_salaires_mensuels, salaires_mensuels.reshape(4, 3, -1).sum(axis = 1),
+            salaires_trimestriels)
+    index_matrix = get_members_index_matrix(menage, roles = [Menage.PERSONNE_DE_REFERENCE, Menage.CONJOINT])
+    salaires = salaires_trimestriels[:, index_matrix]
+    salaires[:, index_matrix < 0] = 0
+    return salaires
+
+
+def calculate_by_trimestre(menage, variable_name, period, function):
+    '''
+    Calculates a quarterly benefit for period, either a quarter or a year, with function(year) returning its
+    (quarters × menages) values for all the quarters of the year. The values of the quarters are cached, so that later
+    quarterly requests reuse them.
+    '''
+    index = trimestre_index(period)
+    year = period.this_year
+    values = function(year)
+    holder = menage.simulation.get_or_new_holder(variable_name)
+    for other_index, trimestre in enumerate(trimestres(year)):
+        if other_index != index:
+            holder.put_in_cache(values[other_index], trimestre)
+    if index is not None:
+        return period, values[index]
+    return year, values.sum(axis = 0)
 
 
 class smig75(Variable):
@@ -88,26 +146,27 @@ class salaire_unique(Variable):
     entity = Menage
     label = u"Indicatrice de salaire unique"
 
-    def function(individu, period):
+    def function(menage, period):
         period = period.this_year
-        salaire_imposable_personne_de_reference = menage.personne_de_reference('salaire_imposable', period = period)
-        salaire_imposable_conjoint = menage.conjoint('salaire_imposable', period = period)
-        return period, xor_(salaire_imposable_personne_de_reference > 0, salaire_imposable_conjoint > 0)
+        salaire_imposable = members_matrix(menage, menage.members('salaire_imposable', period = period),
+            roles = [Menage.PERSONNE_DE_REFERENCE, Menage.CONJOINT])
+        # Un seul des deux membres du couple a un salaire
+        return period, (salaire_imposable > 0).sum(axis = 1) == 1
+
+
+#
+# Allocations familiales
+#
 
-    #
-    # Allocations familiales
-    #
 
 class af_nbenf(Variable):
     column = FloatCol
     entity = Menage
     label = u"Nombre d'enfants au sens des allocations familiales"
 
-    def function(individu, period, legislation):
+    def function(menage, period):
         period = period.this_year
-        age_holder = menage.members('age', period = period)
-        smig75_holder = menage.members('smig75', period = period)
-        inv_holder = menage.members('inv', period = period)
+        age = menage.members('age', period = period)
 
         #    From http://www.allocationfamiliale.com/allocationsfamiliales/allocationsfamilialestunisie.htm
         #    Jusqu'à l'âge de 16 ans sans conditions.
@@ -122,16 +181,10 @@ class af_nbenf(Variable):
         # intégralement par un organisme public ou privé benéficiant de l'aide de l'Etat ou des collectivités
         # locales.
 
-        age = self.split_by_roles(age_holder, roles=ENFS)
-        smig75 = self.split_by_roles(smig75_holder, roles=ENFS)
-        inv = self.split_by_roles(inv_holder, roles=ENFS)
-
-        ages = ages_first_kids(age, nb=3)
-        res = zeros(ages[0].shape)
-
-        for ag in ages:
-            res += (ag >= 0) * (
-                (1 * (ag < 16) + 1 * (ag < 18) + 1 * (ag < 21)) >= 1)
+        # Les places vides ont un âge négatif.
+        ages = ages_first_kids(members_matrix(menage, age, roles = [Menage.ENFANT], fill_value = -9999))
+        res = ((ages >= 0) * (
+            (1 * (ages < 16) + 1 * (ages < 18) + 1 * (ages < 21)) >= 1)).sum(axis = 1)
     # (ag < 18) + # *smig75[key]*(activite[key] =='aprenti')  + # TODO apprenti
     # (ag < 21) # *(or_(activite[key]=='eleve', activite[key]=='etudiant'))
     #                 )  > 1
@@ -145,26 +198,25 @@ class af(Variable):
     label = u"Allocations familiales"
 
     def function(menage, period, legislation):
-        period = period.this_year
-        af_nbenf = simulation.calculate('af_nbenf', period = period)
-        salaire_imposable_holder = simulation.compute('salaire_imposable', period = period)
-        _P = simulation.legislation(period.start)
-
-        # Le montant trimestriel est calculé en pourcentage de la rémunération globale trimestrielle palfonnée
-        # à 122 dinars
-        # TODO: ajouter éligibilité des parents aux allocations familiales
-        salaire_imposable = self.split_by_roles(
-            salaire_imposable_holder, roles=[CHEF, PART])
-        P = _P.prestations_familiales
-        bm = min_(
-            max_(salaire_imposable[CHEF], salaire_imposable[PART]) / 4, P.af.plaf_trim)  # base trimestrielle
-        # prestations familliales  # Règle d'arrondi ?
-        af_1enf = round(bm * P.af.taux.enf1, 2)
-        af_2enf = round(bm * P.af.taux.enf2, 2)
-        af_3enf = round(bm * P.af.taux.enf3, 2)
-        af_base = (af_nbenf >= 1) * af_1enf + \
-            (af_nbenf >= 2) * af_2enf + (af_nbenf >= 3) * af_3enf
-        return period, 4 * af_base  # annualisé
+        def af_trimestriels(year):
+            af_nbenf = menage('af_nbenf', period = year)
+            # Le montant trimestriel est calculé en pourcentage de la rémunération globale trimestrielle palfonnée
+            # à 122 dinars
+            # TODO: ajouter éligibilité des parents aux allocations familiales
+            salaire_trimestriel = salaires_trimestriels_parents(menage, year).max(axis = 2)
+            af_trimestriels = zeros(salaire_trimestriel.shape)
+            for index, trimestre in enumerate(trimestres(year)):
+                P = legislation(trimestre.start).prestations_familiales
+                bm = min_(salaire_trimestriel[index], P.af.plaf_trim)  # base trimestrielle
+                # prestations familliales  # Règle d'arrondi ?
+                af_1enf = round(bm * P.af.taux.enf1, 2)
+                af_2enf = round(bm * P.af.taux.enf2, 2)
+                af_3enf = round(bm * P.af.taux.enf3, 2)
+                af_trimestriels[index] = (af_nbenf >= 1) * af_1enf + \
+                    (af_nbenf >= 2) * af_2enf + (af_nbenf >= 3) * af_3enf
+            return af_trimestriels
+
+        return calculate_by_trimestre(menage, 'af', period, af_trimestriels)
 
 
 class majoration_salaire_unique(Variable):
@@ -173,16 +225,22 @@ class majoration_salaire_unique(Variable):
     label = u"Majoration du salaire unique"
 
     def function(menage, period, legislation):
-        period = period.this_year  # TODO trimestrialiser
-        salaire_unique = menage('salaire_unique', period = period)
-        af_nbenf = menage('af_nbenf', period = period)
-        P = legislation(period.start).prestations_familiales
-        af_1enf = round(P.salaire_unique.enf1, 3)  # trimestrielle
-        af_2enf = round(P.salaire_unique.enf2, 3)  # trimestrielle
-        af_3enf = round(P.salaire_unique.enf3, 3)  # trimestrielle
-        af = (af_nbenf >= 1) * af_1enf + (af_nbenf >= 2) * \
-            af_2enf + (af_nbenf >= 3) * af_3enf
-        return period, 4 * af * salaire_unique  # annualisé
+        def majorations_trimestrielles(year):
+            af_nbenf = menage('af_nbenf', period = year)
+            # Un seul des deux membres du couple a un salaire au cours du trimestre
+            salaire_unique = (salaires_trimestriels_parents(menage, year) > 0).sum(axis = 2) == 1
+            majorations = zeros(salaire_unique.shape)
+            for index, trimestre in enumerate(trimestres(year)):
+                P = legislation(trimestre.start).prestations_familiales
+                af_1enf = round(P.salaire_unique.enf1, 3)  # trimestrielle
+                af_2enf = round(P.salaire_unique.enf2, 3)  # trimestrielle
+                af_3enf = round(P.salaire_unique.enf3, 3)  # trimestrielle
+                af = (af_nbenf >= 1) * af_1enf + (af_nbenf >= 2) * \
+                    af_2enf + (af_nbenf >= 3) * af_3enf
+                majorations[index] = af * salaire_unique[index]
+            return majorations
+
+        return calculate_by_trimestre(menage, 'majoration_salaire_unique', period, majorations_trimestrielles)
 
 
 def _af_cong_naiss(age, _P):
@@ -208,16 +266,14 @@ class contribution_frais_creche(Variable):
     entity = Menage
     label = u"Contribution aux frais de crêche"
 
-    def function(individu, period, legislation):
+    def function(menage, period, legislation):
         '''
         Contribution aux frais de crêche
         'fam'
         '''
         period = period.this_year
-        salaire_imposable_holder = menage('salaire_imposable', period = period)
-        age_en_mois_holder = menage('age_en_mois', period = period)
-        smig48 = legislation(period.start).cotisations_sociales.gen.smig  # TODO: smig 48H
-        # TODO rework and test
+        smig_48h_mensuel = legislation(period.start).cotisations_sociales.gen.smig_48h_mensuel
+        # TODO rework
         # Une prise en charge peut être accordée à la mère exerçant une
         # activité salariée et dont le salaire ne dépasse pas deux fois et demie
         # le SMIG pour 48 heures de travail par semaine. Cette contribution est
@@ -229,11 +285,12 @@ class contribution_frais_creche(Variable):
             menage.personne_de_reference('salaire_imposable', period = period) +
             menage.conjoint('salaire_imposable', period = period)
             )
-        age_en_mois = menage.members('age_en_mois')
-        P = _P.prestations_familiales.creche
-        age_m_benj = age_en_mois_benjamin(age_en_mois)
+        date_naissance = menage.members('date_naissance', period = period)
+        age_en_mois = (datetime64(period.start.date, 'M') - date_naissance.astype('datetime64[M]')).astype(int)
+        P = legislation(period.start).prestations_familiales.creche
+        age_m_benj = age_en_mois_benjamin(menage, age_en_mois)
         elig_age = (age_m_benj <= P.age_max) * (age_m_benj >= P.age_min)
-        elig_sal = somme_salaire_imposable < P.plaf * smig48
+        elig_sal = somme_salaire_imposable < P.plaf * 12 * smig_48h_mensuel
         return period, P.montant * elig_age * elig_sal * min_(P.duree, 12 - age_m_benj)
 
 
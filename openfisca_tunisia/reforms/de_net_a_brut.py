@@ -2,38 +2,131 @@
 
 from __future__ import division
 
+from numpy import absolute as abs_, fmax, fmin, inf, isfinite, ones, where
+
 from openfisca_core import columns
 from openfisca_core.reforms import Reform
 from openfisca_core.variables import Variable
 
-try:
-    from scipy.optimize import fsolve
-except ImportError:
-    fsolve = None
-
 from .. import entities
-
-
-def calculate_net_from(salaire_imposable, simulation, period, requested_variable_names):
+from ..calculations import wrap_methods
+
+
+def invert_increasing_function(function, target, guess, delta = 1, tolerance = 1 / 100, max_iterations = 50):
+    """Inverse, ligne par ligne, une fonction vectorisée croissante et linéaire par morceaux.
+
+    Les cotisations et l'impôt étant des barèmes à taux marginaux, le net est linéaire par morceaux en fonction du
+    brut. Chaque ligne est résolue indépendamment par une méthode de Newton : sur le segment qui contient un essai,
+    l'inverse est exact (essai + (cible - net) / pente, la pente du segment étant mesurée par une différence finie de
+    `delta`). Chaque ligne garde aussi un encadrement de sa solution, et un pas de Newton qui en sort est remplacé
+    par une bissection (ou, tant qu'une seule borne est connue, par le même pas depuis cette borne), ce qui assure la
+    convergence aux discontinuités (abattement SMIG par exemple). Une ligne
+    s'arrête dès que son net est à moins de `tolerance` de sa cible ou que son encadrement est plus étroit que
+    `tolerance`. La mémoire utilisée est proportionnelle au nombre de lignes.
+    """
+    essai = guess.copy()
+    resultat = function(essai)
+    # Encadrement de la solution, infini tant qu'aucun essai n'est tombé du bon côté.
+    bas = -inf * ones(len(essai))
+    haut = inf * ones(len(essai))
+    for _ in range(max_iterations):
+        ecart = target - resultat
+        bas = where(ecart > 0, fmax(bas, essai), bas)
+        haut = where(ecart < 0, fmin(haut, essai), haut)
+        non_converge = (abs_(ecart) > tolerance) & ~(haut - bas <= tolerance)
+        if not non_converge.any():
+            break
+        pente = (function(essai + delta) - resultat) / delta
+        pente = where(pente > 0, pente, 1)
+        pas = ecart / pente
+        newton = essai + pas
+        dans_encadrement = (newton > bas) & (newton < haut)
+        # Bissection quand la solution est encadrée, sinon pas de Newton depuis la borne connue
+        bas_connu = isfinite(bas)
+        haut_connu = isfinite(haut)
+        bas_fini = where(bas_connu, bas, essai)
+        haut_fini = where(haut_connu, haut, essai)
+        repli = where(bas_connu & haut_connu, (bas_fini + haut_fini) / 2, where(bas_connu, bas_fini, haut_fini) + pas)
+        essai = where(non_converge, where(dans_encadrement, newton, repli), essai)
+        resultat = function(essai)
+    return essai
+
+
+def record_callers(simulation):
+    """Enregistre, pour chaque variable calculée par la simulation, les variables qui l'ont demandée.
+
+    Renvoie le dictionnaire des appelants par nom de variable, rempli au fil des calculs, et une fonction qui
+    arrête l'enregistrement."""
+    callers_by_variable_name = {}
+    stack = []
+
+    def make_recording_method(method):
+        def recording_method(variable_name, *args, **kwargs):
+            if stack:
+                callers_by_variable_name.setdefault(variable_name, set()).add(stack[-1])
+            stack.append(variable_name)
+            try:
+                return method(variable_name, *args, **kwargs)
+            finally:
+                stack.pop()
+        return recording_method
+
+    stop = wrap_methods(simulation, ('calculate', 'calculate_add', 'calculate_divide'), make_recording_method)
+    return callers_by_variable_name, stop
+
+
+def make_net_calculator(simulation, period, requested_variable_names):
+    """Renvoie une fonction qui calcule le salaire net à payer à partir d'un salaire imposable.
+
+    La simulation n'est clonée qu'une fois. Au premier calcul, les variables qui dépendent du salaire imposable
+    sont repérées ; les calculs suivants n'effacent et ne recalculent que celles-ci."""
     # We're not wanting to calculate salaire_imposable again, but instead manually set it as an input variable
     # To avoid possible conflicts, remove its function
     simulation.holder_by_name['salaire_imposable'].formula.function = None
-    simulation.get_or_new_holder('salaire_imposable').array = salaire_imposable
 
-    # Work in isolation
-    temp_simulation = simulation.clone()
+    # Work in isolation, in a single scratch simulation reused by every evaluation
+    scratch_simulation = simulation.clone()
 
     # Calculated variable holders might contain undesired cache
     # (their entity.simulation points to the original simulation above)
     for name in requested_variable_names:
-        del temp_simulation.holder_by_name[name]
-
-    # Force recomputing of salaire_net
-    del temp_simulation.holder_by_name['salaire_net_a_payer']
-
-    net = temp_simulation.calculate('salaire_net_a_payer', period)[0]
-
-    return net
+        scratch_simulation.holder_by_name.pop(name, None)
+    scratch_simulation.holder_by_name.pop('salaire_net_a_payer', None)
+
+    downstream_variable_names = []
+
+    def calculate_net(salaire_imposable):
+        for name in downstream_variable_names:
+            scratch_simulation.holder_by_name.pop(name, None)
+        scratch_simulation.get_or_new_holder('salaire_imposable').array = salaire_imposable
+        if downstream_variable_names:
+            return scratch_simulation.calculate('salaire_net_a_payer', period)
+
+        variable_names_before = set(scratch_simulation.holder_by_name)
+        callers_by_variable_name, stop_recording = record_callers(scratch_simulation)
+        try:
+            net = scratch_simulation.calculate('salaire_net_a_payer', period)
+        finally:
+            stop_recording()
+        computed_variable_names = set(scratch_simulation.holder_by_name) - variable_names_before
+        computed_variable_names.add('salaire_net_a_payer')
+
+        # Variables qui dépendent, directement ou non, du salaire imposable
+        dependent_variable_names = set()
+        pending_variable_names = ['salaire_imposable']
+        while pending_variable_names:
+            for caller_name in callers_by_variable_name.get(pending_variable_names.pop(), ()):
+                if caller_name not in dependent_variable_names:
+                    dependent_variable_names.add(caller_name)
+                    pending_variable_names.append(caller_name)
+        if 'salaire_net_a_payer' in dependent_variable_names:
+            downstream_variable_names.extend(computed_variable_names & dependent_variable_names)
+        else:
+            # Dependencies could not be recorded: recompute everything that was computed.
+            downstream_variable_names.extend(computed_variable_names)
+        return net
+
+    return calculate_net
 
 
 class salaire_imposable(Variable):
@@ -42,7 +135,7 @@ class salaire_imposable(Variable):
     label = u"Salaire imposable"
 
     def function(self, simulation, period):
-        # Calcule le salaire brut à partir du salaire net par inversion numérique.
+        # Calcule le salaire brut à partir du salaire net par inversion ligne par ligne.
         net = simulation.get_array('salaire_net_a_payer', period)
         assert net is not None
         simulation = self.holder.entity.simulation
@@ -58,17 +151,12 @@ class salaire_imposable(Variable):
         # as an input variable, hence producing a cycle error
         simulation.requested_periods_by_variable_name = dict()
 
-        def solve_func(net):
-            def innerfunc(essai):
-                return calculate_net_from(essai, simulation, period, requested_variable_names) - net
-            return innerfunc
-
-        brut_calcule = \
-            fsolve(
-                solve_func(net),
-                net * 1.25,  # on entend souvent parler cette méthode...
-                xtol = 1 / 100  # précision
-                )
+        brut_calcule = invert_increasing_function(
+            make_net_calculator(simulation, period, requested_variable_names),
+            net,
+            net * 1.25,  # on entend souvent parler cette méthode...
+            tolerance = 1 / 100,  # précision
+            )
 
         return period, brut_calcule
 
@@ -7,8 +7,11 @@ import itertools
 import logging
 import re
 import uuid
+import weakref
 
-from openfisca_core import conv, scenarios
+import numpy as np
+
+from openfisca_core import conv, periods, scenarios
 from entities import Individu, FoyerFiscal, Menage
 
 
@@ -19,8 +22,130 @@ def N_(message):
 log = logging.getLogger(__name__)
 year_or_month_or_day_re = re.compile(ur'(18|19|20)\d{2}(-(0[1-9]|1[0-2])(-([0-2]\d|3[0-1]))?)?$')
 
+# Group entities linked to individus by columns (entity key, entity id column, legacy role column, roles by legacy
+# role). The last role is used for every greater legacy role.
+LINKS = [
+    (FoyerFiscal, 'idfoy', 'quifoy', [
+        FoyerFiscal.DECLARANT_PRINCIPAL,
+        FoyerFiscal.CONJOINT,
+        FoyerFiscal.PERSONNE_A_CHARGE,
+        ]),
+    (Menage, 'idmen', 'quimen', [
+        Menage.PERSONNE_DE_REFERENCE,
+        Menage.CONJOINT,
+        Menage.ENFANT,
+        ]),
+    ]
+
 
 class Scenario(scenarios.AbstractScenario):
+    input_columns_by_entity_key = None
+    # When True, test cases are assumed to be already valid and canonical (as produced by another program) and are
+    # only checked by is_valid_trusted_test_case. The conversion pipeline is used only when this check fails, to report
+    # errors.
+    trusted = False
+
+    def init_from_columns(self, period, individus, foyers_fiscaux = None, menages = None):
+        """Initialize the scenario from columns of survey data, without building a test case.
+
+        Each of individus, foyers_fiscaux and menages maps variable names to arrays of values (a dict of NumPy arrays,
+        or a pandas DataFrame read from a CSV or Parquet file). individus must contain the link columns idfoy, quifoy,
+        idmen and quimen. foyers_fiscaux and menages may contain an id column, to which idfoy and idmen refer;
+        otherwise idfoy and idmen are row positions. The rows of foyers_fiscaux and menages must be in the order in
+        which their ids first appear in idfoy and idmen, with the rows without member last.
+        """
+        self.axes = None
+        self.input_variables = None
+        self.period = periods.period(period)
+        self.test_case = None
+        self.input_columns_by_entity_key = {
+            Individu.key: individus,
+            FoyerFiscal.key: foyers_fiscaux if foyers_fiscaux is not None else {},
+            Menage.key: menages if menages is not None else {},
+            }
+        return self
+
+    def fill_simulation(self, simulation, use_set_input_hooks = True, variables_name_to_skip = None):
+        if self.input_columns_by_entity_key is None:
+            return scenarios.AbstractScenario.fill_simulation(self, simulation,
+                use_set_input_hooks = use_set_input_hooks, variables_name_to_skip = variables_name_to_skip)
+
+        column_by_name = self.tax_benefit_system.column_by_name
+        input_columns_by_entity_key = self.input_columns_by_entity_key
+        individus = input_columns_by_entity_key[Individu.key]
+        persons = simulation.persons
+        persons.count = persons.step_size = count = len(np.asarray(individus['idfoy']))
+        array_by_name_by_entity_key = {Individu.key: {}}
+
+        for entity_class, id_name, role_name, roles in LINKS:
+            entity = simulation.entities[entity_class.key]
+            entity_columns = input_columns_by_entity_key[entity_class.key]
+            members_entity_id = np.asarray(individus[id_name])
+            members_legacy_role = np.asarray(individus[role_name], dtype = np.int32)
+            assert len(members_entity_id) == len(members_legacy_role) == count, \
+                u'Link columns {} and {} must have one value per individu'.format(id_name, role_name)
+            entity_column_names = list(entity_columns)
+            if 'id' in entity_column_names:
+                entity_ids = np.asarray(entity_columns['id'])
+            elif entity_column_names:
+                entity_ids = np.arange(len(np.asarray(entity_columns[entity_column_names[0]])))
+            else:
+                entity_ids = np.arange(members_entity_id.max() + 1 if count > 0 else 0)
+            assert len(np.unique(entity_ids)) == len(entity_ids), u'Ids of {} must be unique'.format(
+                entity_class.plural)
+
+            # Position of the entity of each individu, using a binary search in the sorted ids.
+            entity_ids_order = np.argsort(entity_ids, kind = 'mergesort')
+            sorted_entity_ids = entity_ids[entity_ids_order]
+            positions = np.minimum(np.searchsorted(sorted_entity_ids, members_entity_id), len(entity_ids) - 1)
+            assert (sorted_entity_ids[positions] == members_entity_id).all(), \
+                u'Some values of {} are not ids of {}'.format(id_name, entity_class.plural)
+
+            members_entity_index = entity_ids_order[positions]
+            # OpenFisca-Core expects the rows of an entity to follow the order in which their members first appear in
+            # individus, with the rows without member last.
+            first_members_index = np.unique(members_entity_index, return_index = True)[1]
+            if (members_entity_index[np.sort(first_members_index)] != np.arange(len(first_members_index))).any():
+                raise ValueError(u'Rows of {} must be in the order in which their ids first appear in {}'.format(
+                    entity_class.plural, id_name).encode('utf-8'))
+
+            entity.count = entity.step_size = len(entity_ids)
+            entity.members_entity_id = members_entity_index.astype(np.int32)
+            entity.members_legacy_role = members_legacy_role
+            entity.members_role = np.array(roles, dtype = object)[np.minimum(members_legacy_role, len(roles) - 1)]
+            entity.roles_count = members_legacy_role.max() + 1 if count > 0 else 0
+            array_by_name_by_entity_key[Individu.key][id_name] = entity.members_entity_id
+            array_by_name_by_entity_key[Individu.key][role_name] = members_legacy_role
+            array_by_name_by_entity_key[entity_class.key] = dict(
+                (name, entity_columns[name])
+                for name in entity_column_names
+                if name != 'id'
+                )
+
+        array_by_name_by_entity_key[Individu.key].update(
+            (name, individus[name])
+            for name in individus
+            if name != 'id' and name not in array_by_name_by_entity_key[Individu.key]
+            )
+
+        for entity_key, array_by_name in array_by_name_by_entity_key.iteritems():
+            for name, values in array_by_name.iteritems():
+                if variables_name_to_skip is not None and name in variables_name_to_skip:
+                    continue
+                column = column_by_name.get(name)
+                if column is None:
+                    raise ValueError(u'Unknown variable {} in columns of {}'.format(name, entity_key).encode('utf-8'))
+                if column.entity.key != entity_key:
+                    raise ValueError(u'Variable {} belongs to {}, not to {}'.format(
+                        name, column.entity.key, entity_key).encode('utf-8'))
+                array = np.asarray(values, dtype = column.dtype)
+                assert len(array) == simulation.entities[entity_key].count, \
+                    u'Column {} must have one value per row of {}'.format(name, entity_key)
+                holder = simulation.get_or_new_holder(name)
+                if use_set_input_hooks:
+                    holder.set_input(self.period, array)
+                else:
+                    holder.put_in_cache(array, self.period)
 
     def init_single_entity(self, axes = None, enfants = None, famille = None, foyer_fiscal = None, menage = None,
             parent1 = None, parent2 = None, period = None):
@@ -67,158 +192,29 @@ class Scenario(scenarios.AbstractScenario):
             if state is None:
                 state = conv.default_state
 
-            column_by_name = self.tax_benefit_system.column_by_name
+            if self.trusted and is_valid_trusted_test_case(value,
+                    get_column_by_name_by_entities_key(self.tax_benefit_system), period):
+                return value, None
 
             # First validation and conversion step
-            test_case, error = conv.pipe(
-                conv.test_isinstance(dict),
-                conv.struct(
-                    dict(
-                        foyers_fiscaux = conv.pipe(
-                            conv.make_item_to_singleton(),
-                            conv.test_isinstance(list),
-                            conv.uniform_sequence(
-                                conv.test_isinstance(dict),
-                                drop_none_items = True,
-                                ),
-                            conv.function(scenarios.set_entities_json_id),
-                            conv.uniform_sequence(
-                                conv.struct(
-                                    dict(itertools.chain(
-                                        dict(
-                                            declarants = conv.pipe(
-                                                conv.make_item_to_singleton(),
-                                                conv.test_isinstance(list),
-                                                conv.uniform_sequence(
-                                                    conv.test_isinstance((basestring, int)),
-                                                    drop_none_items = True,
-                                                    ),
-                                                conv.default([]),
-                                                ),
-                                            id = conv.pipe(
-                                                conv.test_isinstance((basestring, int)),
-                                                conv.not_none,
-                                                ),
-                                            personnes_a_charge = conv.pipe(
-                                                conv.make_item_to_singleton(),
-                                                conv.test_isinstance(list),
-                                                conv.uniform_sequence(
-                                                    conv.test_isinstance((basestring, int)),
-                                                    drop_none_items = True,
-                                                    ),
-                                                conv.default([]),
-                                                ),
-                                            ).iteritems(),
-                                        (
-                                            (column.name, column.json_to_python)
-                                            for column in column_by_name.itervalues()
-                                            if column.entity == 'fam'
-                                            ),
-                                        )),
-                                    drop_none_values = True,
-                                    ),
-                                drop_none_items = True,
-                                ),
-                            conv.default([]),
-                            ),
-                        individus = conv.pipe(
-                            conv.make_item_to_singleton(),
-                            conv.test_isinstance(list),
-                            conv.uniform_sequence(
-                                conv.test_isinstance(dict),
-                                drop_none_items = True,
-                                ),
-                            conv.function(scenarios.set_entities_json_id),
-                            conv.uniform_sequence(
-                                conv.struct(
-                                    dict(itertools.chain(
-                                        dict(
-                                            id = conv.pipe(
-                                                conv.test_isinstance((basestring, int)),
-                                                conv.not_none,
-                                                ),
-                                            ).iteritems(),
-                                        (
-                                            (column.name, column.json_to_python)
-                                            for column in column_by_name.itervalues()
-                                            if column.entity == Individu
-                                            ),
-                                        )),
-                                    drop_none_values = True,
-                                    ),
-                                drop_none_items = True,
-                                ),
-                            conv.empty_to_none,
-                            conv.not_none,
-                            ),
-                        menages = conv.pipe(
-                            conv.make_item_to_singleton(),
-                            conv.test_isinstance(list),
-                            conv.uniform_sequence(
-                                conv.test_isinstance(dict),
-                                drop_none_items = True,
-                                ),
-                            conv.function(scenarios.set_entities_json_id),
-                            conv.uniform_sequence(
-                                conv.struct(
-                                    dict(itertools.chain(
-                                        dict(
-                                            autres = conv.pipe(
-                                                # personnes ayant un lien autre avec la personne de référence
-                                                conv.make_item_to_singleton(),
-                                                conv.test_isinstance(list),
-                                                conv.uniform_sequence(
-                                                    conv.test_isinstance((basestring, int)),
-                                                    drop_none_items = True,
-                                                    ),
-                                                conv.default([]),
-                                                ),
-                                            # conjoint de la personne de référence
-                                            conjoint = conv.test_isinstance((basestring, int)),
-                                            enfants = conv.pipe(
-                                                # enfants de la personne de référence ou de son conjoint
-                                                conv.make_item_to_singleton(),
-                                                conv.test_isinstance(list),
-                                                conv.uniform_sequence(
-                                                    conv.test_isinstance((basestring, int)),
-                                                    drop_none_items = True,
-                                                    ),
-                                                conv.default([]),
-                                                ),
-                                            id = conv.pipe(
-                                                conv.test_isinstance((basestring, int)),
-                                                conv.not_none,
-                                                ),
-                                            personne_de_reference = conv.test_isinstance((basestring, int)),
-                                            ).iteritems(),
-                                        (
-                                            (column.name, column.json_to_python)
-                                            for column in column_by_name.itervalues()
-                                            if column.entity == Menage
-                                            ),
-                                        )),
-                                    drop_none_values = True,
-                                    ),
-                                drop_none_items = True,
-                                ),
-                            conv.default([]),
-                            ),
-                        ),
-                    ),
-                )(value, state = state)
+            test_case, error = get_json_or_python_to_entities(self.tax_benefit_system)(value, state = state)
             if error is not None:
                 return test_case, error
 
             # Second validation step
-            foyers_fiscaux_individus_id = [individu['id'] for individu in test_case['individus']]
-            menages_individus_id = [individu['id'] for individu in test_case['individus']]
+            # Ordered dicts mapping each id to itself, so that ids can be tested and removed in constant time.
+            foyers_fiscaux_individus_id = collections.OrderedDict(
+                (individu['id'], individu['id'])
+                for individu in test_case['individus']
+                )
+            menages_individus_id = foyers_fiscaux_individus_id.copy()
             test_case, error = conv.struct(
                 dict(
                     foyers_fiscaux = conv.uniform_sequence(
                         conv.struct(
                             dict(
-                                declarants = conv.uniform_sequence(conv.test_in_pop(foyers_fiscaux_individus_id)),
-                                personnes_a_charge = conv.uniform_sequence(conv.test_in_pop(
+                                declarants = conv.uniform_sequence(test_in_pop_id(foyers_fiscaux_individus_id)),
+                                personnes_a_charge = conv.uniform_sequence(test_in_pop_id(
                                     foyers_fiscaux_individus_id)),
                                 ),
                             default = conv.noop,
@@ -227,10 +223,10 @@ class Scenario(scenarios.AbstractScenario):
                     menages = conv.uniform_sequence(
                         conv.struct(
                             dict(
-                                autres = conv.uniform_sequence(conv.test_in_pop(menages_individus_id)),
-                                conjoint = conv.test_in_pop(menages_individus_id),
-                                enfants = conv.uniform_sequence(conv.test_in_pop(menages_individus_id)),
-                                personne_de_reference = conv.test_in_pop(menages_individus_id),
+                                autres = conv.uniform_sequence(test_in_pop_id(menages_individus_id)),
+                                conjoint = test_in_pop_id(menages_individus_id),
+                                enfants = conv.uniform_sequence(test_in_pop_id(menages_individus_id)),
+                                personne_de_reference = test_in_pop_id(menages_individus_id),
                                 ),
                             default = conv.noop,
                             ),
@@ -245,51 +241,62 @@ class Scenario(scenarios.AbstractScenario):
                 }
 
             if repair:
+                # Index des foyers fiscaux et ménages de chaque individu, tenu à jour au fil des affectations
+                foyer_fiscal_and_role_by_individu_id = index_foyers_fiscaux_roles(test_case)
+                menage_and_role_by_individu_id = index_menages_roles(test_case)
+
                 # Affecte à un foyer fiscal chaque individu qui n'appartient à aucun d'entre eux.
                 new_foyer_fiscal = dict(
                     declarants = [],
                     personnes_a_charge = [],
                     )
                 new_foyer_fiscal_id = None
-                for individu_id in foyers_fiscaux_individus_id[:]:
+                for individu_id in foyers_fiscaux_individus_id.keys():
 
                     # Tente d'affecter l'individu à un foyer fiscal d'après son ménage.
-                    menage, menage_role = find_menage_and_role(test_case, individu_id)
+                    menage, menage_role = menage_and_role_by_individu_id.get(individu_id, (None, None))
                     if menage_role == u'personne_de_reference':
                         conjoint_id = menage[u'conjoint']
                         if conjoint_id is not None:
-                            foyer_fiscal, other_role = find_foyer_fiscal_and_role(test_case, conjoint_id)
+                            foyer_fiscal, other_role = foyer_fiscal_and_role_by_individu_id.get(conjoint_id,
+                                (None, None))
                             if other_role == u'declarants' and len(foyer_fiscal[u'declarants']) == 1:
                                 # Quand l'individu n'est pas encore dans un foyer fiscal, mais qu'il est personne de
                                 # référence dans un ménage, qu'il y a un conjoint dans ce ménage et que ce
                                 # conjoint est seul déclarant dans un foyer fiscal, alors ajoute l'individu comme
                                 # autre déclarant de ce foyer fiscal.
                                 foyer_fiscal[u'declarants'].append(individu_id)
-                                foyers_fiscaux_individus_id.remove(individu_id)
+                                foyer_fiscal_and_role_by_individu_id[individu_id] = (foyer_fiscal, u'declarants')
+                                del foyers_fiscaux_individus_id[individu_id]
                     elif menage_role == u'conjoint':
                         personne_de_reference_id = menage[u'personne_de_reference']
                         if personne_de_reference_id is not None:
-                            foyer_fiscal, other_role = find_foyer_fiscal_and_role(test_case, personne_de_reference_id)
+                            foyer_fiscal, other_role = foyer_fiscal_and_role_by_individu_id.get(
+                                personne_de_reference_id, (None, None))
                             if other_role == u'declarants' and len(foyer_fiscal[u'declarants']) == 1:
                                 # Quand l'individu n'est pas encore dans un foyer fiscal, mais qu'il est conjoint
                                 # dans un ménage, qu'il y a une personne de référence dans ce ménage et que
                                 # cette personne est seul déclarant dans un foyer fiscal, alors ajoute l'individu
                                 # comme autre déclarant de ce foyer fiscal.
                                 foyer_fiscal[u'declarants'].append(individu_id)
-                                foyers_fiscaux_individus_id.remove(individu_id)
+                                foyer_fiscal_and_role_by_individu_id[individu_id] = (foyer_fiscal, u'declarants')
+                                del foyers_fiscaux_individus_id[individu_id]
                     elif menage_role == u'enfants' and (menage['personne_de_reference'] is not None
                             or menage[u'conjoint'] is not None):
                         for other_id in (menage['personne_de_reference'], menage[u'conjoint']):
                             if other_id is None:
                                 continue
-                            foyer_fiscal, other_role = find_foyer_fiscal_and_role(test_case, other_id)
+                            foyer_fiscal, other_role = foyer_fiscal_and_role_by_individu_id.get(other_id,
+                                (None, None))
                             if other_role == u'declarants':
                                 # Quand l'individu n'est pas encore dans un foyer fiscal, mais qu'il est enfant dans
                                 # un ménage, qu'il y a une personne à charge ou un conjoint dans ce ménage et que
                                 # celui-ci est déclarant dans un foyer fiscal, alors ajoute l'individu comme
                                 # personne à charge de ce foyer fiscal.
                                 foyer_fiscal[u'personnes_a_charge'].append(individu_id)
-                                foyers_fiscaux_individus_id.remove(individu_id)
+                                foyer_fiscal_and_role_by_individu_id[individu_id] = (foyer_fiscal,
+                                    u'personnes_a_charge')
+                                del foyers_fiscaux_individus_id[individu_id]
                                 break
 
                     if individu_id in foyers_fiscaux_individus_id:
@@ -298,12 +305,15 @@ class Scenario(scenarios.AbstractScenario):
                         age = find_age(individu, period.start.date)
                         if len(new_foyer_fiscal[u'declarants']) < 2 and (age is None or age >= 18):
                             new_foyer_fiscal[u'declarants'].append(individu_id)
+                            foyer_fiscal_and_role_by_individu_id[individu_id] = (new_foyer_fiscal, u'declarants')
                         else:
                             new_foyer_fiscal[u'personnes_a_charge'].append(individu_id)
+                            foyer_fiscal_and_role_by_individu_id[individu_id] = (new_foyer_fiscal,
+                                u'personnes_a_charge')
                         if new_foyer_fiscal_id is None:
                             new_foyer_fiscal[u'id'] = new_foyer_fiscal_id = unicode(uuid.uuid4())
                             test_case[u'foyers_fiscaux'].append(new_foyer_fiscal)
-                        foyers_fiscaux_individus_id.remove(individu_id)
+                        del foyers_fiscaux_individus_id[individu_id]
 
                 # Affecte à un ménage chaque individu qui n'appartient à aucun d'entre eux.
                 new_menage = dict(
@@ -313,13 +323,15 @@ class Scenario(scenarios.AbstractScenario):
                     personne_de_reference = None,
                     )
                 new_menage_id = None
-                for individu_id in menages_individus_id[:]:
+                for individu_id in menages_individus_id.keys():
                     # Tente d'affecter l'individu à un ménage d'après son foyer fiscal.
-                    foyer_fiscal, foyer_fiscal_role = find_foyer_fiscal_and_role(test_case, individu_id)
+                    foyer_fiscal, foyer_fiscal_role = foyer_fiscal_and_role_by_individu_id.get(individu_id,
+                        (None, None))
                     if foyer_fiscal_role == u'declarants' and len(foyer_fiscal[u'declarants']) == 2:
                         for declarant_id in foyer_fiscal[u'declarants']:
                             if declarant_id != individu_id:
-                                menage, other_role = find_menage_and_role(test_case, declarant_id)
+                                menage, other_role = menage_and_role_by_individu_id.get(declarant_id,
+                                    (None, None))
                                 if other_role == u'personne_de_reference' and menage[u'conjoint'] is None:
                                     # Quand l'individu n'est pas encore dans un ménage, mais qu'il est déclarant
                                     # dans un foyer fiscal, qu'il y a un autre déclarant dans ce foyer fiscal et que
@@ -327,7 +339,8 @@ class Scenario(scenarios.AbstractScenario):
                                     # pas de conjoint dans ce ménage, alors ajoute l'individu comme conjoint de ce
                                     # ménage.
                                     menage[u'conjoint'] = individu_id
-                                    menages_individus_id.remove(individu_id)
+                                    menage_and_role_by_individu_id[individu_id] = (menage, u'conjoint')
+                                    del menages_individus_id[individu_id]
                                 elif other_role == u'conjoint' and menage[u'personne_de_reference'] is None:
                                     # Quand l'individu n'est pas encore dans un ménage, mais qu'il est déclarant
                                     # dans une foyer fiscal, qu'il y a un autre déclarant dans ce foyer fiscal et
@@ -335,32 +348,37 @@ class Scenario(scenarios.AbstractScenario):
                                     # personne de référence dans ce ménage, alors ajoute l'individu comme personne
                                     # de référence de ce ménage.
                                     menage[u'personne_de_reference'] = individu_id
-                                    menages_individus_id.remove(individu_id)
+                                    menage_and_role_by_individu_id[individu_id] = (menage, u'personne_de_reference')
+                                    del menages_individus_id[individu_id]
                                 break
                     elif foyer_fiscal_role == u'personnes_a_charge' and foyer_fiscal[u'declarants']:
                         for declarant_id in foyer_fiscal[u'declarants']:
-                            menage, other_role = find_menage_and_role(test_case, declarant_id)
+                            menage, other_role = menage_and_role_by_individu_id.get(declarant_id, (None, None))
                             if other_role in (u'personne_de_reference', u'conjoint'):
                                 # Quand l'individu n'est pas encore dans un ménage, mais qu'il est personne à charge
                                 # dans un foyer fiscal, qu'il y a un déclarant dans ce foyer fiscal et que ce
                                 # déclarant est personne de référence ou conjoint dans un ménage, alors ajoute
                                 # l'individu comme enfant de ce ménage.
                                 menage[u'enfants'].append(individu_id)
-                                menages_individus_id.remove(individu_id)
+                                menage_and_role_by_individu_id[individu_id] = (menage, u'enfants')
+                                del menages_individus_id[individu_id]
                                 break
 
                     if individu_id in menages_individus_id:
                         # L'individu n'est toujours pas affecté à un ménage.
                         if new_menage[u'personne_de_reference'] is None:
                             new_menage[u'personne_de_reference'] = individu_id
+                            menage_and_role_by_individu_id[individu_id] = (new_menage, u'personne_de_reference')
                         elif new_menage[u'conjoint'] is None:
                             new_menage[u'conjoint'] = individu_id
+                            menage_and_role_by_individu_id[individu_id] = (new_menage, u'conjoint')
                         else:
                             new_menage[u'enfants'].append(individu_id)
+                            menage_and_role_by_individu_id[individu_id] = (new_menage, u'enfants')
                         if new_menage_id is None:
                             new_menage[u'id'] = new_menage_id = unicode(uuid.uuid4())
                             test_case[u'menages'].append(new_menage)
-                        menages_individus_id.remove(individu_id)
+                        del menages_individus_id[individu_id]
 
             remaining_individus_id = set(foyers_fiscaux_individus_id).union(menages_individus_id)
             if remaining_individus_id:
@@ -385,7 +403,10 @@ class Scenario(scenarios.AbstractScenario):
                 return test_case, error
 
             # Third validation step
-            individu_by_id = test_case['individus']
+            individu_by_id = dict(
+                (individu['id'], individu)
+                for individu in test_case['individus']
+                )
             test_case, error = conv.struct(
                 dict(
                     foyers_fiscaux = conv.pipe(
@@ -566,6 +587,196 @@ class Scenario(scenarios.AbstractScenario):
         return self_json
 
 
+# Conversion schemas
+
+
+# Cached converters and columns, by tax benefit system. The number of columns is stored along, in case columns are
+# added after the first use.
+json_or_python_to_entities_by_tax_benefit_system = weakref.WeakKeyDictionary()
+column_by_name_by_entities_key_by_tax_benefit_system = weakref.WeakKeyDictionary()
+
+
+def get_columns_key(tax_benefit_system):
+    """Return a key identifying the columns of a tax benefit system, which changes when a column is replaced."""
+    return tuple(id(column) for column in tax_benefit_system.column_by_name.itervalues())
+
+
+def get_column_by_name_by_entities_key(tax_benefit_system):
+    """Return the input columns of each entity of test cases, computed once per tax benefit system."""
+    column_by_name = tax_benefit_system.column_by_name
+    columns_key = get_columns_key(tax_benefit_system)
+    cached_columns_key, column_by_name_by_entities_key = column_by_name_by_entities_key_by_tax_benefit_system.get(
+        tax_benefit_system, (None, None))
+    if cached_columns_key != columns_key:
+        column_by_name_by_entities_key = dict(
+            (entities_key, dict(
+                (column.name, column)
+                for column in column_by_name.itervalues()
+                if column.entity == entity
+                ))
+            for entities_key, entity in (
+                # Columns of foyers fiscaux are not accepted in test cases.
+                (u'foyers_fiscaux', 'fam'),
+                (u'individus', Individu),
+                (u'menages', Menage),
+                )
+            )
+        column_by_name_by_entities_key_by_tax_benefit_system[tax_benefit_system] = (columns_key,
+            column_by_name_by_entities_key)
+    return column_by_name_by_entities_key
+
+
+def get_json_or_python_to_entities(tax_benefit_system):
+    """Return the converter of the first validation and conversion step of test cases, built once per tax benefit
+    system."""
+    columns_key = get_columns_key(tax_benefit_system)
+    cached_columns_key, json_or_python_to_entities = json_or_python_to_entities_by_tax_benefit_system.get(
+        tax_benefit_system, (None, None))
+    if cached_columns_key != columns_key:
+        json_or_python_to_entities = make_json_or_python_to_entities(
+            get_column_by_name_by_entities_key(tax_benefit_system))
+        json_or_python_to_entities_by_tax_benefit_system[tax_benefit_system] = (columns_key,
+            json_or_python_to_entities)
+    return json_or_python_to_entities
+
+
+def make_json_or_python_to_entities(column_by_name_by_entities_key):
+    """Return the converter of the first validation and conversion step of test cases."""
+    return conv.pipe(
+        conv.test_isinstance(dict),
+        conv.struct(
+            dict(
+                foyers_fiscaux = conv.pipe(
+                    conv.make_item_to_singleton(),
+                    conv.test_isinstance(list),
+                    conv.uniform_sequence(
+                        conv.test_isinstance(dict),
+                        drop_none_items = True,
+                        ),
+                    conv.function(scenarios.set_entities_json_id),
+                    conv.uniform_sequence(
+                        conv.struct(
+                            dict(itertools.chain(
+                                dict(
+                                    declarants = conv.pipe(
+                                        conv.make_item_to_singleton(),
+                                        conv.test_isinstance(list),
+                                        conv.uniform_sequence(
+                                            conv.test_isinstance((basestring, int)),
+                                            drop_none_items = True,
+                                            ),
+                                        conv.default([]),
+                                        ),
+                                    id = conv.pipe(
+                                        conv.test_isinstance((basestring, int)),
+                                        conv.not_none,
+                                        ),
+                                    personnes_a_charge = conv.pipe(
+                                        conv.make_item_to_singleton(),
+                                        conv.test_isinstance(list),
+                                        conv.uniform_sequence(
+                                            conv.test_isinstance((basestring, int)),
+                                            drop_none_items = True,
+                                            ),
+                                        conv.default([]),
+                                        ),
+                                    ).iteritems(),
+                                (
+                                    (column.name, column.json_to_python)
+                                    for column in column_by_name_by_entities_key[u'foyers_fiscaux'].itervalues()
+                                    ),
+                                )),
+                            drop_none_values = True,
+                            ),
+                        drop_none_items = True,
+                        ),
+                    conv.default([]),
+                    ),
+                individus = conv.pipe(
+                    conv.make_item_to_singleton(),
+                    conv.test_isinstance(list),
+                    conv.uniform_sequence(
+                        conv.test_isinstance(dict),
+                        drop_none_items = True,
+                        ),
+                    conv.function(scenarios.set_entities_json_id),
+                    conv.uniform_sequence(
+                        conv.struct(
+                            dict(itertools.chain(
+                                dict(
+                                    id = conv.pipe(
+                                        conv.test_isinstance((basestring, int)),
+                                        conv.not_none,
+                                        ),
+                                    ).iteritems(),
+                                (
+                                    (column.name, column.json_to_python)
+                                    for column in column_by_name_by_entities_key[u'individus'].itervalues()
+                                    ),
+                                )),
+                            drop_none_values = True,
+                            ),
+                        drop_none_items = True,
+                        ),
+                    conv.empty_to_none,
+                    conv.not_none,
+                    ),
+                menages = conv.pipe(
+                    conv.make_item_to_singleton(),
+                    conv.test_isinstance(list),
+                    conv.uniform_sequence(
+                        conv.test_isinstance(dict),
+                        drop_none_items = True,
+                        ),
+                    conv.function(scenarios.set_entities_json_id),
+                    conv.uniform_sequence(
+                        conv.struct(
+                            dict(itertools.chain(
+                                dict(
+                                    autres = conv.pipe(
+                                        # personnes ayant un lien autre avec la personne de référence
+                                        conv.make_item_to_singleton(),
+                                        conv.test_isinstance(list),
+                                        conv.uniform_sequence(
+                                            conv.test_isinstance((basestring, int)),
+                                            drop_none_items = True,
+                                            ),
+                                        conv.default([]),
+                                        ),
+                                    # conjoint de la personne de référence
+                                    conjoint = conv.test_isinstance((basestring, int)),
+                                    enfants = conv.pipe(
+                                        # enfants de la personne de référence ou de son conjoint
+                                        conv.make_item_to_singleton(),
+                                        conv.test_isinstance(list),
+                                        conv.uniform_sequence(
+                                            conv.test_isinstance((basestring, int)),
+                                            drop_none_items = True,
+                                            ),
+                                        conv.default([]),
+                                        ),
+                                    id = conv.pipe(
+                                        conv.test_isinstance((basestring, int)),
+                                        conv.not_none,
+                                        ),
+                                    personne_de_reference = conv.test_isinstance((basestring, int)),
+                                    ).iteritems(),
+                                (
+                                    (column.name, column.json_to_python)
+                                    for column in column_by_name_by_entities_key[u'menages'].itervalues()
+                                    ),
+                                )),
+                            drop_none_values = True,
+                            ),
+                        drop_none_items = True,
+                        ),
+                    conv.default([]),
+                    ),
+                ),
+            ),
+        )
+
+
 # Finders
 
 
@@ -619,3 +830,132 @@ def find_menage_and_role(test_case, individu_id):
             if individu_id in menage[role]:
                 return menage, role
     return None, None
+
+
+# Indexes
+
+
+def index_foyers_fiscaux_roles(test_case):
+    """Return a dict mapping each individu id to its foyer fiscal and role, as found by find_foyer_fiscal_and_role."""
+    foyer_fiscal_and_role_by_individu_id = {}
+    for foyer_fiscal in test_case['foyers_fiscaux']:
+        for role in (u'declarants', u'personnes_a_charge'):
+            for individu_id in foyer_fiscal[role]:
+                foyer_fiscal_and_role_by_individu_id.setdefault(individu_id, (foyer_fiscal, role))
+    return foyer_fiscal_and_role_by_individu_id
+
+
+def index_menages_roles(test_case):
+    """Return a dict mapping each individu id to its menage and role, as found by find_menage_and_role."""
+    menage_and_role_by_individu_id = {}
+    for menage in test_case['menages']:
+        for role in (u'personne_de_reference', u'conjoint'):
+            individu_id = menage.get(role)
+            if individu_id is not None:
+                menage_and_role_by_individu_id.setdefault(individu_id, (menage, role))
+        for role in (u'enfants', u'autres'):
+            for individu_id in menage[role]:
+                menage_and_role_by_individu_id.setdefault(individu_id, (menage, role))
+    return menage_and_role_by_individu_id
+
+
+# Converters
+
+
+def test_in_pop_id(individus_id):
+    """Like conv.test_in_pop, in constant time, for an ordered dict mapping each individu id to itself."""
+    return conv.pipe(
+        conv.test_in(individus_id),
+        conv.function(individus_id.pop),
+        )
+
+
+# Trusted test cases
+
+
+def is_value_of_column(value, column):
+    kind = np.dtype(column.dtype).kind
+    if kind == 'b':
+        return isinstance(value, (bool, np.bool_))
+    if kind in 'iu':
+        return isinstance(value, (int, long, np.integer)) and not isinstance(value, bool)
+    if kind == 'f':
+        return isinstance(value, (int, long, float, np.integer, np.floating)) and not isinstance(value, bool)
+    if kind == 'M':
+        return isinstance(value, datetime.date)
+    return isinstance(value, basestring)
+
+
+def is_valid_trusted_test_case(test_case, column_by_name_by_entities_key, period):
+    """Check that a test case is already valid and canonical, without the conversion pipeline.
+
+    The checks are plain Python loops over the entities and their variables, with sets for the memberships. They
+    convert nothing and build no intermediate test case, which is what makes them cheaper than the pipeline. Returns
+    False as soon as a check fails. The test case must then go through the conversion pipeline, which repairs it or
+    reports the errors.
+    """
+    if not isinstance(test_case, dict) or not set(test_case).issubset((u'foyers_fiscaux', u'individus', u'menages')):
+        return False
+    foyers_fiscaux = test_case.get(u'foyers_fiscaux')
+    individus = test_case.get(u'individus')
+    menages = test_case.get(u'menages')
+    for entities_json in (foyers_fiscaux, individus, menages):
+        if not isinstance(entities_json, list) or not entities_json:
+            return False
+        if not all(isinstance(entity_json, dict) for entity_json in entities_json):
+            return False
+        entities_id = [entity_json.get(u'id') for entity_json in entities_json]
+        if not all(isinstance(entity_id, (basestring, int)) for entity_id in entities_id):
+            return False
+        if len(set(entities_id)) != len(entities_id):
+            return False
+
+    # Variables
+    for entities_key, roles in (
+            (u'foyers_fiscaux', (u'declarants', u'personnes_a_charge')),
+            (u'individus', ()),
+            (u'menages', (u'autres', u'conjoint', u'enfants', u'personne_de_reference')),
+            ):
+        column_by_name = column_by_name_by_entities_key[entities_key]
+        for entity_json in test_case[entities_key]:
+            for name, value in entity_json.iteritems():
+                if name == u'id' or name in roles:
+                    continue
+                column = column_by_name.get(name)
+                if column is None or not is_value_of_column(value, column):
+                    return False
+
+    # Roles
+    individus_id = set(individu[u'id'] for individu in individus)
+    for foyer_fiscal in foyers_fiscaux:
+        if not isinstance(foyer_fiscal.get(u'declarants'), list) \
+                or not isinstance(foyer_fiscal.get(u'personnes_a_charge'), list):
+            return False
+    declarants_count = np.array([len(foyer_fiscal[u'declarants']) for foyer_fiscal in foyers_fiscaux])
+    if not ((declarants_count >= 1) & (declarants_count <= 2)).all():
+        return False
+    foyers_fiscaux_members_id = list(itertools.chain.from_iterable(
+        foyer_fiscal[u'declarants'] + foyer_fiscal[u'personnes_a_charge']
+        for foyer_fiscal in foyers_fiscaux
+        ))
+    if len(foyers_fiscaux_members_id) != len(individus_id) or set(foyers_fiscaux_members_id) != individus_id:
+        return False
+    for menage in menages:
+        if menage.get(u'personne_de_reference') is None or not isinstance(menage.get(u'autres'), list) \
+                or not isinstance(menage.get(u'enfants'), list):
+            return False
+    menages_members_id = list(itertools.chain.from_iterable(
+        [menage[u'personne_de_reference']] + ([menage[u'conjoint']] if menage.get(u'conjoint') is not None else [])
+            + menage[u'enfants'] + menage[u'autres']
+        for menage in menages
+        ))
+    if len(menages_members_id) != len(individus_id) or set(menages_members_id) != individus_id:
+        return False
+
+    individu_by_id = dict((individu[u'id'], individu) for individu in individus)
+    return all(
+        individu_by_id[individu_id].get('inv', False)
+        or find_age(individu_by_id[individu_id], period.start.date, default = 0) < 25
+        for foyer_fiscal in foyers_fiscaux
+        for individu_id in foyer_fiscal[u'personnes_a_charge']
+        )
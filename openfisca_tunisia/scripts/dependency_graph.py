@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""Print the dependency graph of variables of the Tunisian model.
+
+Without variable, print the dependencies of every variable. With variables, print the variables they require, level
+by level: the variables of a level only require variables of the previous levels.
+"""
+
+
+import argparse
+import datetime
+import logging
+import os
+import sys
+
+from openfisca_tunisia import dependencies, TunisiaTaxBenefitSystem
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+log = logging.getLogger(app_name)
+
+
+def trace(tax_benefit_system, variables_name, year):
+    simulation = tax_benefit_system.new_scenario().init_single_entity(
+        period = year,
+        parent1 = dict(date_naissance = datetime.date(year - 40, 1, 1), salaire_de_base = 12000),
+        parent2 = dict(date_naissance = datetime.date(year - 40, 1, 1)),
+        enfants = [
+            dict(date_naissance = datetime.date(year - 9, 1, 1)),
+            dict(date_naissance = datetime.date(year - 8, 1, 1)),
+            ],
+        ).new_simulation()
+    return dependencies.trace_graph(simulation, variables_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('variables', nargs = '*', help = "names of the output variables")
+    parser.add_argument('-d', '--dot', action = 'store_true', default = False, help = "print the graph in DOT format")
+    parser.add_argument('-t', '--trace', action = 'store_true', default = False,
+        help = "complete the static graph by tracing the calculation of the variables in a sample simulation")
+    parser.add_argument('-y', '--year', default = 2011, type = int, help = "year of the traced simulation")
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stdout)
+
+    tax_benefit_system = TunisiaTaxBenefitSystem()
+    graph = dependencies.DependencyGraph()
+    graph.update(tax_benefit_system.get_dependency_graph())
+    if args.trace:
+        if not args.variables:
+            parser.error(u'Tracing requires output variables')
+        graph.update(trace(tax_benefit_system, args.variables, args.year))
+
+    variables_name = graph.find_required_variables(args.variables) if args.variables \
+        else set(tax_benefit_system.column_by_name)
+    if args.dot:
+        print(u'digraph dependencies {')
+        for variable_name in sorted(variables_name):
+            for dependency in sorted(graph.dependencies_by_variable_name.get(variable_name, ())):
+                print(u'    "{}" -> "{}" [label = "{}"];'.format(variable_name, dependency.variable_name,
+                    u' '.join(part for part in (dependency.projection, dependency.period_transform) +
+                        (dependency.options or ()) if part)))
+        print(u'}')
+    elif args.variables:
+        for level, level_variables_name in enumerate(graph.group_by_level(args.variables)):
+            print(u'{}: {}'.format(level, u' '.join(level_variables_name)))
+    else:
+        for variable_name in sorted(variables_name):
+            print(u'{} ({}): {}'.format(variable_name, graph.entity_key_by_variable_name.get(variable_name),
+                u', '.join(sorted(graph.get_inputs_name(variable_name)))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+
+"""Memory-mapped storage of the arrays of a simulation, for simulations larger than the available memory.
+
+Once the arrays held in memory by the holders of a simulation exceed a budget, the largest ones are moved to
+memory-mapped files in a scratch directory. Holders get plain numpy.ndarray views of the memory maps, since
+OpenFisca-Core checks the exact type of the arrays it caches, and the operating system pages them in and out of memory
+as needed. Hot variables, used by many formulas, stay in memory.
+"""
+
+
+import logging
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+
+from openfisca_tunisia.calculations import wrap_methods
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_RESIDENT_VARIABLES_NAME = frozenset([
+    'rni',
+    'salaire_imposable',
+    ])
+
+
+class MemoryMappedStorage(object):
+    """Spill the arrays of a simulation to memory-mapped files when they exceed ram_budget bytes.
+
+    The arrays returned by the calculations requested to the simulation are counted as they come, and the holders are
+    only scanned when their total crosses the budget. The arrays of resident variables are neither counted nor
+    spilled. Use close() (or a with statement) to stop enforcing the budget and to remove the scratch directory, once
+    the simulation is no longer used.
+    """
+    def __init__(self, simulation, ram_budget, directory = None, resident_variables_name = None):
+        self.simulation = simulation
+        self.ram_budget = ram_budget
+        if directory is None:
+            self.directory = tempfile.mkdtemp(prefix = 'openfisca-tunisia-')
+            self.owns_directory = True
+        else:
+            self.directory = directory
+            self.owns_directory = False
+        self.resident_variables_name = DEFAULT_RESIDENT_VARIABLES_NAME if resident_variables_name is None \
+            else frozenset(resident_variables_name)
+        self.spilled_arrays_count = 0
+        self.scans_count = 0
+        # Arrays already counted in resident_size, by id. Weak references let freed arrays go.
+        self.counted_array_by_id = weakref.WeakValueDictionary()
+        self.resident_size = 0
+
+        self.restore_methods = wrap_methods(simulation, ('calculate', 'calculate_add', 'calculate_divide', 'compute',
+            'compute_add', 'compute_divide'), self.make_counting_method)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.close()
+
+    def close(self):
+        self.restore_methods()
+        if self.owns_directory:
+            # Memory-mapped arrays still referenced remain readable: their files are only unlinked.
+            shutil.rmtree(self.directory, ignore_errors = True)
+
+    def count_array(self, variable_name, array):
+        """Add a new array to the size of the resident arrays, and enforce the budget once it is crossed.
+
+        Arrays freed meanwhile are still counted: the size is an upper bound, made exact again by each scan.
+        """
+        if array is None or variable_name in self.resident_variables_name or not is_spillable(array) \
+                or self.counted_array_by_id.get(id(array)) is array:
+            return
+        self.counted_array_by_id[id(array)] = array
+        self.resident_size += array.nbytes
+        if self.resident_size > self.ram_budget:
+            self.enforce_budget()
+
+    def enforce_budget(self):
+        """Scan the holders and spill their largest arrays until the resident ones fit in the budget."""
+        self.scans_count += 1
+        resident_arrays = [
+            (holder, period, array)
+            for holder, period, array in self.iter_resident_arrays()
+            if holder.column.name not in self.resident_variables_name
+            ]
+        resident_size = sum(array.nbytes for _, _, array in resident_arrays)
+        spilled_arrays_id = set()
+        for holder, period, array in sorted(resident_arrays, key = lambda item: item[2].nbytes, reverse = True):
+            if resident_size <= self.ram_budget:
+                break
+            self.spill(holder, period, array)
+            spilled_arrays_id.add(id(array))
+            resident_size -= array.nbytes
+        self.counted_array_by_id = weakref.WeakValueDictionary(
+            (id(array), array)
+            for _, _, array in resident_arrays
+            if id(array) not in spilled_arrays_id
+            )
+        self.resident_size = resident_size
+
+    def iter_resident_arrays(self):
+        """Yield the (holder, period, array) of the arrays held in memory that can be memory-mapped.
+
+        period is None for the arrays of holders that don't depend on the period.
+        """
+        for holder in self.simulation.holder_by_name.itervalues():
+            array = getattr(holder, '_array', None)
+            if array is not None and is_spillable(array):
+                yield holder, None, array
+            array_by_period = getattr(holder, '_array_by_period', None)
+            if array_by_period is not None:
+                for period, array in array_by_period.iteritems():
+                    if is_spillable(array):
+                        yield holder, period, array
+
+    def make_counting_method(self, method):
+        def counting_method(variable_name, *args, **kwargs):
+            result = method(variable_name, *args, **kwargs)
+            # calculate* methods return arrays, compute* methods return dated holders.
+            self.count_array(variable_name, result if isinstance(result, np.ndarray) else getattr(result, 'array',
+                None))
+            return result
+        return counting_method
+
+    def spill(self, holder, period, array):
+        path = os.path.join(self.directory, '{}.dat'.format(self.spilled_arrays_count))
+        self.spilled_arrays_count += 1
+        memory_mapped_array = np.memmap(path, dtype = array.dtype, mode = 'w+', shape = array.shape)
+        memory_mapped_array[...] = array
+        memory_mapped_array.flush()
+        array = memory_mapped_array.view(np.ndarray)
+        if period is None:
+            holder._array = array
+        else:
+            holder._array_by_period[period] = array
+        log.debug(u'Spilled {}@{} ({} bytes) to {}'.format(holder.column.name, period, array.nbytes, path))
+
+
+def is_memory_mapped(array):
+    return isinstance(array, np.memmap) or isinstance(getattr(array, 'base', None), np.memmap)
+
+
+def is_spillable(array):
+    return isinstance(array, np.ndarray) and not is_memory_mapped(array) and array.dtype.kind != 'O' and array.size > 0
+
+
+def use_memory_mapped_storage(simulation, ram_budget, directory = None, resident_variables_name = None):
+    """Make the simulation spill its arrays to memory-mapped files beyond ram_budget bytes, and return the storage."""
+    return MemoryMappedStorage(simulation, ram_budget, directory = directory,
+        resident_variables_name = resident_variables_name)
@@ -5,8 +5,8 @@ from openfisca_core.tools import assert_near
 
 from .. import TunisiaTaxBenefitSystem
 from ..reforms import (
+    de_net_a_brut,
     plf_2017,
-
     )
 
 __all__ = [
@@ -23,21 +23,11 @@ tax_benefit_system = TunisiaTaxBenefitSystem()
 # Reforms cache, used by long scripts like test_yaml.py
 # The reforms commented haven't been adapted to the new core API yet.
 reform_list = {
+    'de_net_a_brut': de_net_a_brut.de_net_a_brut,
     'plf_2017': plf_2017.plf_2017,
     }
 
 
-# Only use the following reform if scipy can be imported
-try:
-    import scipy
-except ImportError:
-    scipy = None
-
-if scipy is not None:
-    from ..reforms import de_net_a_brut
-    reform_list['de_net_a_brut'] = de_net_a_brut.de_net_a_brut
-
-
 reform_by_full_key = {}
 
 
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+
+import os
+import shutil
+import tempfile
+
+from openfisca_tunisia import cache
+from openfisca_tunisia.tunisia_taxbenefitsystem import make_legislation_cache_key
+
+
+def check_with_cache_dir(cache_dir, check):
+    previous_cache_dir = os.environ.get(cache.CACHE_DIR_ENVIRONMENT_VARIABLE)
+    os.environ[cache.CACHE_DIR_ENVIRONMENT_VARIABLE] = cache_dir
+    try:
+        check()
+    finally:
+        if previous_cache_dir is None:
+            del os.environ[cache.CACHE_DIR_ENVIRONMENT_VARIABLE]
+        else:
+            os.environ[cache.CACHE_DIR_ENVIRONMENT_VARIABLE] = previous_cache_dir
+
+
+def test_round_trip():
+    cache_dir = tempfile.mkdtemp()
+
+    def check():
+        key = cache.make_key(u'param.xml', 'content')
+        assert cache.load('tests', key) is None
+        cache.dump('tests', key, dict(values = [1, 2.5, u'DT']))
+        assert cache.load('tests', key) == dict(values = [1, 2.5, u'DT'])
+        assert os.listdir(os.path.join(cache_dir, 'tests')) == ['{}.pickle'.format(key)]
+
+    try:
+        check_with_cache_dir(cache_dir, check)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_disabled_cache():
+    def check():
+        cache.dump('tests', 'key', 1)
+        assert cache.load('tests', 'key') is None
+
+    check_with_cache_dir('', check)
+
+
+def test_keys_depend_on_parts_boundaries():
+    assert cache.make_key('ab', 'c') != cache.make_key('a', 'bc')
+
+
+def preprocess_legislation(legislation_json):
+    return legislation_json
+
+
+def test_legislation_key_depends_on_preprocessing():
+    assert make_legislation_cache_key([]) != make_legislation_cache_key([],
+        preprocess_legislation = preprocess_legislation)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+
+import datetime
+
+from openfisca_core import periods
+
+from openfisca_tunisia import calculations
+from openfisca_tunisia.tests.base import assert_near, tax_benefit_system
+
+
+def new_simulation(year):
+    return tax_benefit_system.new_scenario().init_single_entity(
+        axes = [dict(
+            count = 10,
+            name = 'salaire_de_base',
+            max = 100000,
+            min = 0,
+            )],
+        period = year,
+        parent1 = dict(date_naissance = datetime.date(year - 40, 1, 1)),
+        parent2 = dict(date_naissance = datetime.date(year - 40, 1, 1)),
+        ).new_simulation()
+
+
+def test_calculate_many():
+    year = 2011
+    variables_name = ['cotisations_salarie', 'irpp', 'revenu_disponible', 'salaire_super_brut']
+    expected_simulation = new_simulation(year)
+    simulation = new_simulation(year)
+    array_by_node = calculations.calculate_many(simulation, variables_name, year)
+    assert [variable_name for variable_name, _ in array_by_node] == variables_name
+    for (variable_name, period), array in array_by_node.iteritems():
+        assert_near(array, expected_simulation.calculate(variable_name, period), absolute_error_margin = 0.01)
+
+    # Intermediate variables are freed, but not inputs.
+    assert not calculations.has_arrays(simulation.holder_by_name['rni'])
+    assert calculations.has_arrays(simulation.holder_by_name['salaire_de_base'])
+
+
+def test_plan():
+    graph = tax_benefit_system.get_dependency_graph()
+    year = periods.period(2011)
+    inputs_node_by_node = calculations.plan(graph, [('cotisations_salarie', year, ())])
+    # ugtt is monthly, and requested with ADD by cotisations_salarie.
+    assert ('ugtt', year, (u'ADD', )) in inputs_node_by_node[('cotisations_salarie', year, ())]
+    # The inputs of nodes having options are resolved by the simulation.
+    assert not inputs_node_by_node[('ugtt', year, (u'ADD', ))]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+
+from openfisca_tunisia.tests.base import assert_near, tax_benefit_system
+
+
+def calculate_single_entity(variable_name, year, salaire_de_base):
+    simulation = tax_benefit_system.new_scenario().init_single_entity(
+        period = year,
+        parent1 = dict(salaire_de_base = salaire_de_base),
+        ).new_simulation()
+    return simulation.calculate(variable_name)
+
+
+def test_init_from_columns():
+    year = 2011
+    simulation = tax_benefit_system.new_scenario().init_from_columns(
+        period = year,
+        individus = dict(
+            idfoy = np.array([20, 20, 10]),
+            quifoy = np.array([0, 1, 0]),
+            idmen = np.array([0, 0, 1]),
+            quimen = np.array([0, 1, 0]),
+            salaire_de_base = np.array([24000, 0, 12000]),
+            ),
+        foyers_fiscaux = dict(id = np.array([20, 10])),
+        ).new_simulation()
+
+    assert_near(
+        simulation.calculate('salaire_imposable'),
+        [
+            calculate_single_entity('salaire_imposable', year, 24000)[0],
+            0,
+            calculate_single_entity('salaire_imposable', year, 12000)[0],
+            ],
+        absolute_error_margin = 0.01,
+        )
+    # Ids don't need to be sorted.
+    assert_near(
+        simulation.calculate('irpp'),
+        [
+            calculate_single_entity('irpp', year, 24000)[0],
+            calculate_single_entity('irpp', year, 12000)[0],
+            ],
+        absolute_error_margin = 0.01,
+        )
+
+
+def test_init_from_columns_in_wrong_order():
+    scenario = tax_benefit_system.new_scenario().init_from_columns(
+        period = 2011,
+        individus = dict(
+            idfoy = np.array([10, 10, 20]),
+            quifoy = np.array([0, 1, 0]),
+            idmen = np.array([0, 0, 1]),
+            quimen = np.array([0, 1, 0]),
+            ),
+        foyers_fiscaux = dict(id = np.array([20, 10])),
+        )
+    try:
+        scenario.new_simulation()
+    except ValueError:
+        pass
+    else:
+        assert False, u'Foyers fiscaux in another order than their members must be rejected'
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+
+import datetime
+
+import numpy as np
+
+from openfisca_core import periods
+
+from openfisca_tunisia.model import base
+from openfisca_tunisia.tests.base import assert_near, tax_benefit_system
+
+
+def new_simulation(year):
+    return tax_benefit_system.new_scenario().init_single_entity(
+        axes = [dict(
+            count = 5,
+            name = 'salaire_de_base',
+            max = 100000,
+            min = 0,
+            )],
+        period = year,
+        parent1 = dict(date_naissance = datetime.date(year - 40, 1, 1)),
+        ).new_simulation()
+
+
+def check_monthly_batches(year, batched):
+    expected_simulation = new_simulation(year)
+    simulation = new_simulation(year)
+    base.enable_monthly_batches(simulation)
+    for variable_name in ('cotisations_employeur', 'cotisations_salarie', 'salaire_imposable'):
+        assert_near(simulation.calculate(variable_name), expected_simulation.calculate(variable_name),
+            absolute_error_margin = 0.01)
+    month = simulation.period.start.period('month')
+    if not batched:
+        # Les barèmes changent en cours d'année : les cotisations annuelles ne sont pas calculées mois par mois.
+        assert simulation.get_holder('retraite_salarie').get_array(month) is None
+        return
+    # Les cotisations mensuelles sont en cache : un douzième des cotisations annuelles, le salaire étant annuel.
+    assert simulation.get_holder('retraite_salarie').get_array(month) is not None
+    assert_near(simulation.calculate('retraite_salarie', month), simulation.calculate('retraite_salarie') / 12,
+        absolute_error_margin = 0.01)
+
+
+def test_monthly_batches():
+    # Les taux changent au 1er juillet 2007.
+    for year, batched in ((2007, False), (2011, True)):
+        yield check_monthly_batches, year, batched
+
+
+def test_unknown_categorie_salarie():
+    year = 2011
+    simulation = new_simulation(year)
+    # Les catégories hors de CAT, négatives ou trop grandes, ne cotisent pas.
+    simulation.get_or_new_holder('categorie_salarie').put_in_cache(np.array([0, -1, 42, 10, 0], dtype = np.int16),
+        periods.period(year))
+    cotisations_employeur = simulation.calculate('cotisations_employeur')
+    assert_near(cotisations_employeur[1:4], [0, 0, 0], absolute_error_margin = 0)
+    assert cotisations_employeur[4] < 0
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+
+import datetime
+import warnings
+
+import numpy as np
+
+from openfisca_core import periods
+
+from openfisca_tunisia.reforms import de_net_a_brut
+from openfisca_tunisia.tests.base import assert_near, get_cached_reform, tax_benefit_system
+
+
+def test_invert_increasing_function():
+    def function(brut):
+        # Linéaire par morceaux, avec une discontinuité à 300
+        return np.where(brut < 100, 0.8 * brut, 0.5 * brut + 30) - np.where(brut > 300, 20, 0)
+
+    target = np.array([10., 80., 200., 250.])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        for guess in (target * 1.25, target * 10):
+            assert_near(function(de_net_a_brut.invert_increasing_function(function, target, guess)), target,
+                absolute_error_margin = 0.01)
+
+
+def new_simulation(system, variable_name, year):
+    return system.new_scenario().init_single_entity(
+        axes = [dict(
+            count = 20,
+            name = variable_name,
+            max = 50000,
+            min = 1000,
+            )],
+        period = year,
+        parent1 = dict(date_naissance = datetime.date(year - 40, 1, 1)),
+        ).new_simulation()
+
+
+def test_round_trip():
+    year = 2011
+    reform = get_cached_reform('de_net_a_brut', tax_benefit_system)
+    simulation = new_simulation(reform, 'salaire_net_a_payer', year)
+    salaire_net_a_payer = simulation.calculate('salaire_net_a_payer')
+    salaire_imposable = simulation.calculate('salaire_imposable')
+
+    # Le calcul direct du net à partir du brut trouvé redonne le net de départ, ligne par ligne.
+    forward_simulation = new_simulation(tax_benefit_system, 'salaire_imposable', year)
+    forward_simulation.get_or_new_holder('salaire_imposable').put_in_cache(salaire_imposable, periods.period(year))
+    assert_near(forward_simulation.calculate('salaire_net_a_payer'), salaire_net_a_payer,
+        relative_error_margin = 0.005)
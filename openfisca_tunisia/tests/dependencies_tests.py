@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+
+import datetime
+
+from openfisca_tunisia import dependencies
+from openfisca_tunisia.tests.base import tax_benefit_system
+
+
+def test_static_graph():
+    graph = tax_benefit_system.get_dependency_graph()
+    assert graph is tax_benefit_system.get_dependency_graph()
+    assert dependencies.Dependency('ir_brut', u'', u'this_year', ()) in graph.dependencies_by_variable_name['irpp']
+    assert dependencies.Dependency('rente', u'declarant_principal', u'this_year', ()) \
+        in graph.dependencies_by_variable_name['rni']
+    assert dependencies.Dependency('ugtt', u'', u'', (u'ADD', )) \
+        in graph.dependencies_by_variable_name['cotisations_salarie']
+    # Dependencies of helper functions are those of the variables calling them.
+    assert 'assiette_cotisations_sociales' in graph.get_inputs_name('retraite_salarie')
+    # The inputs of folded stubs are never computed.
+    assert not graph.get_inputs_name('nb_infirme')
+    assert graph.entity_key_by_variable_name['rni'] == 'foyer_fiscal'
+
+
+def test_topological_order():
+    graph = tax_benefit_system.get_dependency_graph()
+    sorted_variables_name = graph.sort_topologically(['revenu_disponible'])
+    assert sorted_variables_name[-1] == 'revenu_disponible'
+    position_by_variable_name = dict(
+        (variable_name, position)
+        for position, variable_name in enumerate(sorted_variables_name)
+        )
+    assert position_by_variable_name['salaire_imposable'] < position_by_variable_name['rni']
+    levels = graph.group_by_level(['revenu_disponible'])
+    assert sorted(sum(levels, [])) == sorted(sorted_variables_name)
+    assert levels[-1] == ['revenu_disponible']
+
+
+def test_traced_graph():
+    year = 2011
+    simulation = tax_benefit_system.new_scenario().init_single_entity(
+        period = year,
+        parent1 = dict(date_naissance = datetime.date(year - 40, 1, 1), salaire_de_base = 12000),
+        ).new_simulation()
+    graph = dependencies.trace_graph(simulation, ['irpp'])
+    assert 'ir_brut' in graph.get_inputs_name('irpp')
+    assert 'salaire_imposable' in graph.find_required_variables(['irpp'])
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+from numpy import logical_not as not_
+
+from openfisca_tunisia import folding
+from openfisca_tunisia.tests.base import assert_near, tax_benefit_system
+
+
+def constant(foyer_fiscal, period):
+    period = period.this_year
+    age = foyer_fiscal.members('age', period = period)
+    boursier = foyer_fiscal.members('boursier', period = period)
+    return period, 0 * age * not_(boursier)
+
+
+def identity(foyer_fiscal, period, legislation):
+    '''
+    TODO
+    '''
+    period = period.this_year
+    rente = foyer_fiscal('rente', period = period)
+    return period, rente
+
+
+def member_identity(foyer_fiscal, period):
+    period = period.this_year
+    age = foyer_fiscal.members('age', period = period)
+    return period, age
+
+
+def not_constant(foyer_fiscal, period):
+    period = period.this_year
+    age = foyer_fiscal.members('age', period = period)
+    return period, 0 * age + 1 * age
+
+
+def test_analyze_function():
+    assert folding.analyze_function(constant) == ('constant', 0, 'this_year')
+    assert folding.analyze_function(identity) == ('alias', 'rente', 'this_year')
+    # Inputs of the members of the entity have another length: they can't be aliased.
+    assert folding.analyze_function(member_identity) is None
+    assert folding.analyze_function(not_constant) is None
+
+
+def test_folded_variables():
+    assert set(['deduc_smig', 'nb_enf_sup', 'nb_infirme']) <= set(tax_benefit_system.folded_constant_by_variable_name)
+    # Aliases are not constants: their input is computed.
+    assert 'revenus_du_travail' not in tax_benefit_system.folded_constant_by_variable_name
+
+    simulation = tax_benefit_system.new_scenario().init_single_entity(
+        period = 2011,
+        parent1 = dict(age = 40),
+        ).new_simulation()
+    assert_near(simulation.calculate('nb_infirme'), [0], absolute_error_margin = 0)
+    # The inputs of folded formulas are not computed.
+    assert simulation.holder_by_name.get('inv') is None or simulation.holder_by_name['inv'].get_array(
+        simulation.period) is None
+
+
+def test_aliased_variables():
+    simulation = tax_benefit_system.new_scenario().init_single_entity(
+        period = 2011,
+        parent1 = dict(age = 40, salaire_de_base = 20000),
+        ).new_simulation()
+    revenus_du_travail = simulation.calculate('revenus_du_travail')
+    salaire_imposable = simulation.calculate('salaire_imposable')
+    assert_near(revenus_du_travail, salaire_imposable, absolute_error_margin = 0)
+    # The alias shares the array of its input.
+    assert np.may_share_memory(revenus_du_travail, salaire_imposable)
+
+
+def test_read_only_constants():
+    simulation = tax_benefit_system.new_scenario().init_single_entity(
+        period = 2011,
+        parent1 = dict(age = 40),
+        ).new_simulation()
+    nb_infirme = simulation.calculate('nb_infirme')
+    try:
+        nb_infirme += 1
+    except ValueError:
+        pass
+    else:
+        assert False, u'Folded constants must be read-only'
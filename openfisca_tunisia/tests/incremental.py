@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""Selection of the YAML tests affected by the changes made since their last run.
+
+The variables calculated by each test during its last run are stored in the persistent cache, with the hashes of the
+modules of the package, of the installed OpenFisca-Core and of the parameters of the legislation. A test is run again
+when:
+- it has never been run, has failed or its YAML file has changed,
+- it has calculated a variable defined in a model module that has changed,
+- it has calculated a variable whose formulas use a parameter that has changed.
+
+Any other change selects every test: a changed module defining no variable (a helper module, the scenarios, the test
+tools...), or another version or location of OpenFisca-Core. Tests using reforms are always run, since the variables
+calculated by reforms in cloned simulations are not recorded.
+"""
+
+
+import ast
+import hashlib
+import json
+import os
+
+import openfisca_core
+import pkg_resources
+
+from openfisca_tunisia import cache
+from openfisca_tunisia.tests import base
+
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORE_KEY = u'openfisca_core'
+STATE_NAMESPACE = 'incremental'
+
+
+def hash_file(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def hash_core():
+    """Return the hash of the version and location of the installed OpenFisca-Core."""
+    try:
+        version = pkg_resources.get_distribution('OpenFisca-Core').version
+    except pkg_resources.DistributionNotFound:
+        version = None
+    return hashlib.sha1(json.dumps([version, os.path.dirname(os.path.abspath(openfisca_core.__file__))])).hexdigest()
+
+
+def hash_modules():
+    """Return the hashes of the modules of the package, by path, and the hash of OpenFisca-Core."""
+    module_hash_by_path = {CORE_KEY: hash_core()}
+    for dir_path, dirs_name, files_name in os.walk(PACKAGE_DIR):
+        for file_name in files_name:
+            if file_name.endswith('.py'):
+                path = os.path.join(dir_path, file_name)
+                module_hash_by_path[path] = hash_file(path)
+    return module_hash_by_path
+
+
+def hash_parameters(legislation_json):
+    """Return the hashes of the parameters and scales of a legislation, by dotted path."""
+    parameter_hash_by_path = {}
+    pending_items = [(u'', legislation_json)]
+    while pending_items:
+        path, node = pending_items.pop()
+        children = node.get('children')
+        if children is None:
+            parameter_hash_by_path[path] = hashlib.sha1(json.dumps(node, default = unicode,
+                sort_keys = True)).hexdigest()
+        else:
+            pending_items.extend(
+                (u'{}.{}'.format(path, name) if path else name, child)
+                for name, child in children.iteritems()
+                )
+    return parameter_hash_by_path
+
+
+def find_legislation_paths(class_node):
+    """Return the dotted paths of the legislation used by the formulas of a variable.
+
+    An empty path means that the whole legislation may be used, for example when it is given to a helper function.
+    """
+    inner_nodes = set()
+    legislation_calls = set()
+    for node in ast.walk(class_node):
+        if isinstance(node, ast.Attribute):
+            inner_nodes.add(node.value)
+        elif isinstance(node, ast.Call):
+            function = node.func
+            if isinstance(function, ast.Name) and function.id == 'legislation' \
+                    or isinstance(function, ast.Attribute) and function.attr == 'legislation':
+                legislation_calls.add(node)
+                inner_nodes.add(function)
+
+    paths = set()
+    for node in ast.walk(class_node):
+        if isinstance(node, ast.Attribute) and node not in inner_nodes:
+            names = []
+            while isinstance(node, ast.Attribute):
+                names.append(node.attr)
+                node = node.value
+            if node in legislation_calls:
+                legislation_calls.remove(node)
+                paths.add(u'.'.join(reversed(names)))
+        elif isinstance(node, ast.Name) and node.id == 'legislation' and node not in inner_nodes \
+                and isinstance(node.ctx, ast.Load):
+            paths.add(u'')
+    if legislation_calls:
+        # Dated legislation stored in a variable before its use.
+        paths.add(u'')
+    return paths
+
+
+def find_variables(module_path):
+    """Return the paths of the legislation used by each variable defined in a module, by variable name."""
+    with open(module_path) as module_file:
+        module_node = ast.parse(module_file.read(), module_path)
+    return dict(
+        (node.name, find_legislation_paths(node))
+        for node in ast.walk(module_node)
+        if isinstance(node, ast.ClassDef) and any(
+            (base_node.id if isinstance(base_node, ast.Name) else getattr(base_node, 'attr', '')).endswith('Variable')
+            for base_node in node.bases
+            )
+        )
+
+
+def is_path_affected(path, changed_paths):
+    return any(
+        changed_path == path or changed_path.startswith(path + u'.') or path.startswith(changed_path + u'.')
+        or not path
+        for changed_path in changed_paths
+        )
+
+
+class Selector(object):
+    """Select the YAML tests to run again and record the variables calculated by the tests that have been run."""
+    def __init__(self):
+        self.state_key = cache.make_key(PACKAGE_DIR)
+        state = cache.load(STATE_NAMESPACE, self.state_key) or {}
+        self.variables_name_by_test_key = state.get('variables_name_by_test_key', {})
+        self.yaml_hash_by_path = state.get('yaml_hash_by_path', {})
+        self.recorded_tests_key = set()
+
+        self.module_hash_by_path = hash_modules()
+        self.parameter_hash_by_path = hash_parameters(base.tax_benefit_system.get_legislation())
+        previous_module_hash_by_path = state.get('module_hash_by_path')
+        previous_parameter_hash_by_path = state.get('parameter_hash_by_path')
+        if previous_module_hash_by_path is None or previous_parameter_hash_by_path is None:
+            self.select_all = True
+            return
+        changed_modules_path = set(
+            path
+            for path in set(self.module_hash_by_path).union(previous_module_hash_by_path)
+            if self.module_hash_by_path.get(path) != previous_module_hash_by_path.get(path)
+            )
+        changed_parameters_path = set(
+            path
+            for path in set(self.parameter_hash_by_path).union(previous_parameter_hash_by_path)
+            if self.parameter_hash_by_path.get(path) != previous_parameter_hash_by_path.get(path)
+            )
+
+        self.select_all = False
+        self.changed_variables_name = set()
+        if CORE_KEY in changed_modules_path:
+            self.select_all = True
+            return
+        for path in changed_modules_path:
+            legislation_paths_by_variable_name = find_variables(path) if os.path.exists(path) else {}
+            if not legislation_paths_by_variable_name:
+                self.select_all = True
+                return
+            self.changed_variables_name.update(legislation_paths_by_variable_name)
+        if changed_parameters_path:
+            for path in self.module_hash_by_path:
+                if path == CORE_KEY:
+                    continue
+                for variable_name, legislation_paths in find_variables(path).iteritems():
+                    if any(is_path_affected(legislation_path, changed_parameters_path)
+                            for legislation_path in legislation_paths):
+                        self.changed_variables_name.add(variable_name)
+
+    def is_selected(self, yaml_path, name, period_str):
+        if self.select_all:
+            return True
+        if self.yaml_hash_by_path.get(yaml_path) != hash_file(yaml_path):
+            return True
+        variables_name = self.variables_name_by_test_key.get((yaml_path, name, period_str))
+        return variables_name is None or not self.changed_variables_name.isdisjoint(variables_name)
+
+    def record(self, yaml_path, name, period_str, variables_name):
+        """Record the variables calculated by a test, or None when it has failed."""
+        test_key = (yaml_path, name, period_str)
+        self.recorded_tests_key.add(test_key)
+        self.variables_name_by_test_key[test_key] = set(variables_name) if variables_name is not None else None
+
+    def save(self):
+        # Tests that should have been run, but have not been (for example because of a name filter), must be run the
+        # next time.
+        for test_key in self.variables_name_by_test_key.keys():
+            if test_key not in self.recorded_tests_key and self.is_selected(*test_key):
+                self.variables_name_by_test_key[test_key] = None
+        for yaml_path, _, _ in self.recorded_tests_key:
+            self.yaml_hash_by_path[yaml_path] = hash_file(yaml_path)
+        cache.dump(STATE_NAMESPACE, self.state_key, dict(
+            module_hash_by_path = self.module_hash_by_path,
+            parameter_hash_by_path = self.parameter_hash_by_path,
+            variables_name_by_test_key = self.variables_name_by_test_key,
+            yaml_hash_by_path = self.yaml_hash_by_path,
+            ))
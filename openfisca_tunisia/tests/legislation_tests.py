@@ -2,8 +2,9 @@
 
 import datetime
 import json
+import multiprocessing
 
-from openfisca_core import conv, legislations, legislationsxml
+from openfisca_core import conv, legislations, legislationsxml, periods
 
 from openfisca_tunisia import TunisiaTaxBenefitSystem
 
@@ -12,7 +13,18 @@ from openfisca_tunisia import TunisiaTaxBenefitSystem
 tax_benefit_system = TunisiaTaxBenefitSystem()
 
 
-def check_legislation_xml_file(year):
+# Legislation converted from XML and validated, shared by the checks of every year
+validated_legislation_json = None
+
+
+def get_validated_legislation_json():
+    global validated_legislation_json
+    if validated_legislation_json is None:
+        validated_legislation_json = validate_legislation_xml_file()
+    return validated_legislation_json
+
+
+def validate_legislation_xml_file():
     legislation_tree = conv.check(legislationsxml.make_xml_legislation_info_list_to_xml_element(False))(
         tax_benefit_system.legislation_xml_info_list, state = conv.default_state)
     legislation_xml_json = conv.check(legislationsxml.xml_legislation_to_json)(
@@ -46,8 +58,11 @@ def check_legislation_xml_file(year):
 
     if tax_benefit_system.preprocess_legislation is not None:
         legislation_json = tax_benefit_system.preprocess_legislation(legislation_json)
+    return legislation_json
+
 
-    legislation_json = legislations.generate_dated_legislation_json(legislation_json, year)
+def check_legislation_xml_file(year):
+    legislation_json = legislations.generate_dated_legislation_json(get_validated_legislation_json(), year)
     legislation_json, errors = legislations.validate_dated_legislation_json(legislation_json,
         state = conv.default_state)
     if errors is not None:
@@ -64,6 +79,37 @@ def check_legislation_xml_file(year):
     assert compact_legislation is not None
 
 
+def check_legislation_xml_file_in_parallel(years, processes = None):
+    """Check the dated legislations of several years in a pool of processes, which inherit the validated legislation."""
+    get_validated_legislation_json()
+    pool = multiprocessing.Pool(processes = processes)
+    try:
+        pool.map(check_legislation_xml_file, years)
+    finally:
+        pool.close()
+        pool.join()
+
+
 def test_legislation_xml_file():
     for year in range(2006, datetime.date.today().year + 1):
         yield check_legislation_xml_file, year
+
+
+def test_legislation_epochs():
+    # No value of param.xml changes between 2015-05-01 and 2017-01-01.
+    assert tax_benefit_system.get_legislation_epoch_instant(periods.instant('2016-11-15')) == \
+        periods.instant('2015-05-01')
+    assert tax_benefit_system.get_compact_legislation(periods.instant('2016-02-01')) is \
+        tax_benefit_system.get_compact_legislation(periods.instant('2016-11-01'))
+    # The employer health insurance rate changes on 2007-07-01.
+    assert tax_benefit_system.get_compact_legislation(periods.instant('2007-06-30')) is not \
+        tax_benefit_system.get_compact_legislation(periods.instant('2007-07-01'))
+
+
+if __name__ == '__main__':
+    import logging
+    import sys
+
+    logging.basicConfig(level = logging.ERROR, stream = sys.stdout)
+    check_legislation_xml_file_in_parallel(range(2006, datetime.date.today().year + 1))
+    test_legislation_epochs()
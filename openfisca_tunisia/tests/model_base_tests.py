@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+
+from openfisca_tunisia.model import base
+from openfisca_tunisia.tests.base import assert_near
+
+
+class Entity(object):
+    # Menages of 3, 1 and 0 members
+    count = 3
+    members_entity_id = np.array([0, 0, 0, 1])
+    members_legacy_role = np.array([0, 2, 1, 0])
+    members_role = np.array(['parent', 'enfant', 'parent', 'parent'])
+
+
+def test_get_members_index_matrix():
+    entity = Entity()
+    assert_near(base.get_members_index_matrix(entity), [[0, 2, 1], [3, -1, -1], [-1, -1, -1]],
+        absolute_error_margin = 0)
+    assert_near(base.get_members_index_matrix(entity, roles = ['parent']), [[0, 2], [3, -1], [-1, -1]],
+        absolute_error_margin = 0)
+    assert_near(base.get_members_index_matrix(entity, roles = ['enfant']), [[1], [-1], [-1]],
+        absolute_error_margin = 0)
+    # Matrices are cached by entity and roles.
+    assert base.get_members_index_matrix(entity, roles = ['parent']) is base.get_members_index_matrix(entity,
+        roles = ('parent', ))
+
+
+def test_members_matrix():
+    entity = Entity()
+    array = np.array([10., 20., 30., 40.])
+    assert_near(base.members_matrix(entity, array), [[10, 30, 20], [40, 0, 0], [0, 0, 0]], absolute_error_margin = 0)
+    assert_near(base.members_matrix(entity, array, roles = ['parent'], fill_value = -1), [[10, 30], [40, -1], [-1, -1]],
+        absolute_error_margin = 0)
+
+
+class UnsortedEntity(Entity):
+    # Menages of 2, 2 and 0 members, whose members are not sorted by menage
+    members_entity_id = np.array([1, 0, 1, 0])
+
+
+def test_group_min_max():
+    values = np.array([5., 2., 7., 4.])
+    for entity, minimum, maximum in (
+            (Entity(), [2, 4, 99], [7, 4, -1]),
+            (UnsortedEntity(), [2, 5, 99], [4, 7, -1]),
+            ):
+        assert_near(base.group_min(entity, values, 99), minimum, absolute_error_margin = 0)
+        assert_near(base.group_max(entity, values, -1), maximum, absolute_error_margin = 0)
+    entity = Entity()
+    assert_near(base.group_min(entity, values, 99, where = np.array([True, False, True, True])), [5, 4, 99],
+        absolute_error_margin = 0)
+    # The second menage has no member left.
+    assert_near(base.group_max(entity, values, -1, where = np.array([False, True, True, False])), [7, -1, -1],
+        absolute_error_margin = 0)
+    assert_near(base.group_min(entity, values, 99, where = np.zeros(4, dtype = bool)), [99, 99, 99],
+        absolute_error_margin = 0)
+
+
+def test_group_argmin():
+    entity = Entity()
+    assert_near(base.group_argmin(entity, np.array([5., 2., 7., 4.])), [1, 3, -1], absolute_error_margin = 0)
+    # The first member wins ties.
+    assert_near(base.group_argmin(entity, np.array([3., 3., 5., 4.])), [0, 3, -1], absolute_error_margin = 0)
+    assert_near(base.group_argmin(entity, np.array([5., 2., 7., 4.]), where = np.array([True, False, True, False])),
+        [0, -1, -1], absolute_error_margin = 0)
+    assert_near(base.group_argmin(UnsortedEntity(), np.array([5., 2., 7., 4.])), [1, 0, -1],
+        absolute_error_margin = 0)
+
+
+def test_group_count():
+    entity = Entity()
+    assert_near(base.group_count(entity), [3, 1, 0], absolute_error_margin = 0)
+    assert_near(base.group_count(entity, where = np.array([False, True, True, True])), [2, 1, 0],
+        absolute_error_margin = 0)
+    assert_near(base.group_count(entity, where = np.array([True, True, True, False])), [3, 0, 0],
+        absolute_error_margin = 0)
+    assert_near(base.group_count(UnsortedEntity()), [2, 2, 0], absolute_error_margin = 0)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+
+import datetime
+
+import numpy as np
+
+from openfisca_core import periods
+
+from openfisca_tunisia.entities import Menage
+from openfisca_tunisia.model import prestations_familiales
+from openfisca_tunisia.model.data import CAT
+from openfisca_tunisia.tests import model_base_tests
+from openfisca_tunisia.tests.base import assert_near, tax_benefit_system
+
+
+def test_ages_first_kids():
+    # Des jumeaux, plus de 3 enfants, et des places vides (âge négatif)
+    ages = np.array([
+        [3, 10, 7, 10, 1],
+        [5, -9999, -9999, -9999, -9999],
+        [-9999, -9999, -9999, -9999, -9999],
+        ])
+    assert_near(prestations_familiales.ages_first_kids(ages), [
+        [10, 10, 7, 3],
+        [5, -9999, -9999, -9999],
+        [-9999, -9999, -9999, -9999],
+        ], absolute_error_margin = 0)
+    assert_near(prestations_familiales.ages_first_kids(ages, nb = 2), [[10, 10], [5, -9999], [-9999, -9999]],
+        absolute_error_margin = 0)
+
+
+def test_age_min_max():
+    entity = model_base_tests.Entity()
+    age = np.array([40, 3, 38, 30])
+    is_enfant = entity.members_role == 'enfant'
+    assert_near(prestations_familiales.age_min(entity, age), [3, 30, 9999], absolute_error_margin = 0)
+    assert_near(prestations_familiales.age_min(entity, age, minimal_age = 18), [38, 30, 9999],
+        absolute_error_margin = 0)
+    assert_near(prestations_familiales.age_min(entity, age, where = is_enfant), [3, 9999, 9999],
+        absolute_error_margin = 0)
+    assert_near(prestations_familiales.age_min(entity, age, minimal_age = 18, where = is_enfant), [9999, 9999, 9999],
+        absolute_error_margin = 0)
+    assert_near(prestations_familiales.age_max(entity, age), [40, 30, -9999], absolute_error_margin = 0)
+    assert_near(prestations_familiales.age_max(entity, age, where = is_enfant), [3, -9999, -9999],
+        absolute_error_margin = 0)
+
+
+def calculate_menage(variables_name, year, enfant_date_naissance, salaire_imposable):
+    simulation = tax_benefit_system.new_scenario().init_single_entity(
+        period = year,
+        parent1 = dict(date_naissance = datetime.date(1980, 1, 1), salaire_imposable = salaire_imposable),
+        enfants = [dict(date_naissance = enfant_date_naissance)],
+        ).new_simulation()
+    return [simulation.calculate(variable_name) for variable_name in variables_name]
+
+
+def test_contribution_frais_creche():
+    year = 2011
+    # Enfant de 6 mois au début de l'année : 6 mois de contribution de 15 dinars
+    contribution_frais_creche, total, af, majoration_salaire_unique = calculate_menage(
+        ['contribution_frais_creche', 'prestations_familiales', 'af', 'majoration_salaire_unique'], year,
+        datetime.date(2010, 7, 1), 6000)
+    assert_near(contribution_frais_creche, [90], absolute_error_margin = 0.01)
+    assert_near(total, af + majoration_salaire_unique + 90, absolute_error_margin = 0.01)
+    # Enfant trop âgé, salaire au-dessus du plafond de 2,5 SMIG 48h mensuels
+    assert_near(calculate_menage(['contribution_frais_creche'], year, datetime.date(2007, 1, 1), 6000)[0], [0],
+        absolute_error_margin = 0.01)
+    assert_near(calculate_menage(['contribution_frais_creche'], year, datetime.date(2010, 7, 1), 9000)[0], [0],
+        absolute_error_margin = 0.01)
+
+
+def new_couple_simulation(year):
+    simulation = tax_benefit_system.new_scenario().init_single_entity(
+        period = year,
+        parent1 = dict(date_naissance = datetime.date(1970, 1, 1)),
+        parent2 = dict(date_naissance = datetime.date(1972, 1, 1)),
+        enfants = [dict(date_naissance = datetime.date(2005, 1, 1))],
+        ).new_simulation()
+    year = periods.period(year)
+    salaire_de_base_holder = simulation.get_or_new_holder('salaire_de_base')
+    holder = simulation.get_or_new_holder('salaire_imposable')
+    # Salaire mensuel de la personne de référence, salaire annuel seulement pour le conjoint
+    for index, salaire in enumerate([100] * 3 + [200] * 3 + [0] * 6):
+        month = year.start.offset(index, 'month').period('month')
+        salaire_de_base_holder.put_in_cache(np.array([salaire, 0., 0.]), month)
+        holder.put_in_cache(np.array([salaire, 0., 0.]), month)
+    holder.put_in_cache(np.array([0., 400., 0.]), year)
+    return simulation
+
+
+def test_salaires_trimestriels_parents():
+    simulation = new_couple_simulation(2011)
+    salaires = prestations_familiales.salaires_trimestriels_parents(simulation.entities[Menage.key],
+        periods.period(2011))
+    assert_near(salaires[:, 0, :], [[300, 100], [600, 100], [0, 100], [0, 100]], absolute_error_margin = 0.01)
+
+
+def test_salaires_annuels_cnrps():
+    # Le salaire imposable mensuel des agents de la CNRPS sans salaire mensuel n'est pas nul (cotisation UGTT) : il ne
+    # doit pas remplacer leur salaire annuel.
+    year = 2011
+    values_by_categorie_salarie = {}
+    for categorie_salarie in (CAT['rsna'], CAT['cnrps_sal']):
+        simulation = tax_benefit_system.new_scenario().init_single_entity(
+            period = year,
+            parent1 = dict(categorie_salarie = categorie_salarie, date_naissance = datetime.date(1970, 1, 1),
+                salaire_de_base = 12000),
+            enfants = [
+                dict(date_naissance = datetime.date(2005, 1, 1)),
+                dict(date_naissance = datetime.date(2007, 1, 1)),
+                ],
+            ).new_simulation()
+        values_by_categorie_salarie[categorie_salarie] = [
+            simulation.calculate(variable_name)
+            for variable_name in ('af', 'majoration_salaire_unique')
+            ]
+    for af, majoration_salaire_unique in values_by_categorie_salarie.itervalues():
+        assert_near(af, [165.92], absolute_error_margin = 0.01)
+        assert_near(majoration_salaire_unique, [112.5], absolute_error_margin = 0.01)
+
+
+def test_calculate_by_trimestre():
+    simulation = new_couple_simulation(2011)
+    menage = simulation.entities[Menage.key]
+    year = periods.period(2011)
+    trimestres = prestations_familiales.trimestres(year)
+    years = []
+
+    def function(year):
+        years.append(year)
+        return np.array([[1.], [2.], [3.], [4.]])
+
+    assert prestations_familiales.trimestre_index(trimestres[1]) == 1
+    assert prestations_familiales.trimestre_index(year) is None
+    period, value = prestations_familiales.calculate_by_trimestre(menage, 'af', trimestres[1], function)
+    assert period == trimestres[1]
+    assert_near(value, [2], absolute_error_margin = 0)
+    # The other quarters are cached.
+    holder = simulation.get_holder('af')
+    for index in (0, 2, 3):
+        assert_near(holder.get_array(trimestres[index]), [index + 1], absolute_error_margin = 0)
+    period, value = prestations_familiales.calculate_by_trimestre(menage, 'af', year, function)
+    assert period == year
+    assert_near(value, [10], absolute_error_margin = 0)
+    assert years == [year, year]
+
+
+def test_af_by_trimestre():
+    simulation = new_couple_simulation(2011)
+    trimestres = prestations_familiales.trimestres(periods.period(2011))
+    af_trimestriels = [simulation.calculate('af', period = trimestres[0])]
+    # Later quarters reuse the values cached by the calculation of the first one.
+    assert all(simulation.get_holder('af').get_array(trimestre) is not None for trimestre in trimestres[1:])
+    af_trimestriels.extend(simulation.calculate('af', period = trimestre) for trimestre in trimestres[1:])
+    assert_near(new_couple_simulation(2011).calculate('af'), sum(af_trimestriels), absolute_error_margin = 0.01)
+    # Pas de majoration de salaire unique au 1er et au 2e trimestre, où les deux parents ont un salaire
+    assert_near(simulation.calculate('majoration_salaire_unique', period = trimestres[0]), [0],
+        absolute_error_margin = 0.01)
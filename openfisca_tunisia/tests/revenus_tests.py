@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+
+from openfisca_core import periods
+
+from openfisca_tunisia.entities import FoyerFiscal
+from openfisca_tunisia.model import base
+from openfisca_tunisia.tests.base import assert_near, tax_benefit_system
+
+
+def new_simulation(year, **parent1):
+    return tax_benefit_system.new_scenario().init_single_entity(
+        period = year,
+        parent1 = parent1,
+        ).new_simulation()
+
+
+def calculate(variable_name, year, **parent1):
+    return new_simulation(year, **parent1).calculate(variable_name)
+
+
+def test_zero_inputs():
+    year = 2011
+    for variable_name in ('beap', 'bic', 'bnc', 'fon_forf_bati', 'fon_forf_nbat', 'rvcm'):
+        assert_near(calculate(variable_name, year, salaire_de_base = 12000), 0, absolute_error_margin = 0.01)
+
+
+def test_nonzero_inputs():
+    year = 2011
+    assert_near(calculate('rvcm', year, capm_banq = 1000, capm_aut = 500), 1500, absolute_error_margin = 0.01)
+    assert_near(calculate('fon_forf_nbat', year, fon_forf_nbat_rec = 1000, fon_forf_nbat_dep = 300), 700,
+        absolute_error_margin = 0.01)
+    assert_near(calculate('beap', year, beap_monogr = 1000, beap_reel_res_fiscal = 500), 1500,
+        absolute_error_margin = 0.01)
+    assert_near(calculate('bic', year, bic_reel_res = 1000), 1000, absolute_error_margin = 0.01)
+
+
+def test_has_nonzero_input():
+    year = 2011
+    simulation = new_simulation(year, capm_banq = 1000)
+    foyer_fiscal = simulation.entities[FoyerFiscal.key]
+    period = periods.period(year)
+    assert base.has_nonzero_input(foyer_fiscal.members, ['capm_aut', 'capm_banq'], period)
+    assert not base.has_nonzero_input(foyer_fiscal.members, ['capm_aut', 'capm_cent'], period)
+    # Variables having a formula are always considered as nonzero.
+    assert base.has_nonzero_input(foyer_fiscal.members, ['salaire_imposable'], period)
+    try:
+        base.has_nonzero_input(foyer_fiscal, ['capm_banq'], period)
+    except AssertionError:
+        pass
+    else:
+        assert False, u'Inputs of individus must be checked on the members of foyers fiscaux'
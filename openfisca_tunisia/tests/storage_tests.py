@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+
+import datetime
+import os
+
+import numpy as np
+
+from openfisca_tunisia import storage
+from openfisca_tunisia.tests.base import assert_near, tax_benefit_system
+
+
+def new_simulation(year):
+    return tax_benefit_system.new_scenario().init_single_entity(
+        axes = [dict(
+            count = 1000,
+            name = 'salaire_de_base',
+            max = 100000,
+            min = 0,
+            )],
+        period = year,
+        parent1 = dict(date_naissance = datetime.date(year - 40, 1, 1)),
+        ).new_simulation()
+
+
+def test_memory_mapped_storage():
+    year = 2011
+    expected_revenu_disponible = new_simulation(year).calculate('revenu_disponible')
+
+    simulation = new_simulation(year)
+    with storage.use_memory_mapped_storage(simulation, ram_budget = 1000) as memory_mapped_storage:
+        directory = memory_mapped_storage.directory
+        assert_near(simulation.calculate('revenu_disponible'), expected_revenu_disponible,
+            absolute_error_margin = 0.01)
+        assert memory_mapped_storage.spilled_arrays_count > 0
+        # Core checks the exact type of cached arrays: holders get plain ndarray views of the memory maps.
+        assert any(
+            type(array) == np.ndarray and storage.is_memory_mapped(array)
+            for holder in simulation.holder_by_name.itervalues()
+            for array in (getattr(holder, '_array_by_period', None) or {}).itervalues()
+            )
+        # Resident variables stay in memory.
+        assert not any(
+            storage.is_memory_mapped(array)
+            for array in (simulation.holder_by_name['salaire_imposable']._array_by_period or {}).itervalues()
+            )
+    assert not os.path.exists(directory)
+    assert 'calculate' not in vars(simulation)
+
+
+def test_budget_not_crossed():
+    year = 2011
+    simulation = new_simulation(year)
+    with storage.use_memory_mapped_storage(simulation, ram_budget = 10 ** 9) as memory_mapped_storage:
+        simulation.calculate('revenu_disponible')
+        # Arrays are counted as they are calculated: the holders are never scanned below the budget.
+        assert memory_mapped_storage.resident_size > 0
+        assert memory_mapped_storage.scans_count == 0
+        assert memory_mapped_storage.spilled_arrays_count == 0
@@ -4,6 +4,7 @@ from __future__ import division
 
 import datetime
 
+from openfisca_tunisia import calculations
 from openfisca_tunisia.model.data import CAT
 from openfisca_tunisia.tests import base
 
@@ -25,9 +26,9 @@ scenarios_arguments = [
 
 
 def check_run(simulation, period):
-    assert simulation.calculate('revenu_disponible') is not None, "Can't compute revdisp on period {}".format(period)
-    assert simulation.calculate('salaire_super_brut') is not None, \
-        "Can't compute salaire_super_brut on period {}".format(period)
+    array_by_node = calculations.calculate_many(simulation, ['revenu_disponible', 'salaire_super_brut'])
+    for (variable_name, _), array in array_by_node.iteritems():
+        assert array is not None, "Can't compute {} on period {}".format(variable_name, period)
 
 
 def test_basics():
@@ -8,14 +8,19 @@ from __future__ import division
 
 import collections
 import copy
+import json
 import logging
+import multiprocessing
 import os
+import time
+import traceback
 
 from openfisca_core import conv, periods, scenarios
 from openfisca_core.tools import assert_near
 import numpy as np
 import yaml
 
+from openfisca_tunisia import cache, scenarios as tunisia_scenarios
 from openfisca_tunisia.tests import base
 
 
@@ -50,7 +55,6 @@ options_by_dir = collections.OrderedDict((
             calculate_output = False,
             default_absolute_error_margin = 0.005,
             reforms = ['de_net_a_brut'],
-            requires = 'scipy',
             ),
         ),
 
@@ -161,6 +165,7 @@ def check(yaml_path, name, period_str, test, force, verbose = False):
                     message = u'{}@{}: '.format(variable_name, period_str),
                     relative_error_margin = test.get('relative_error_margin'),
                     )
+    return simulation
 
 
 def check_calculate_output(yaml_path, name, period_str, test, force, verbose = False):
@@ -190,9 +195,242 @@ def check_calculate_output(yaml_path, name, period_str, test, force, verbose = F
                     message = u'{}@{}: '.format(variable_name, period_str),
                     relative_error_margin = test.get('relative_error_margin'),
                     )
+    return simulation
+
+
+def merge_cases(test_cases):
+    """Merge test cases into a single test case, prefixing the ids of each one with its index."""
+    merged_test_case = dict(foyers_fiscaux = [], individus = [], menages = [])
+    for index, test_case in enumerate(test_cases):
+        def prefix_id(id):
+            return None if id is None else u'{}-{}'.format(index, id)
+
+        for individu in test_case['individus']:
+            individu = individu.copy()
+            individu['id'] = prefix_id(individu['id'])
+            merged_test_case['individus'].append(individu)
+        for foyer_fiscal in test_case['foyers_fiscaux']:
+            foyer_fiscal = foyer_fiscal.copy()
+            foyer_fiscal['id'] = prefix_id(foyer_fiscal['id'])
+            for role in ('declarants', 'personnes_a_charge'):
+                foyer_fiscal[role] = [prefix_id(id) for id in foyer_fiscal[role]]
+            merged_test_case['foyers_fiscaux'].append(foyer_fiscal)
+        for menage in test_case['menages']:
+            menage = menage.copy()
+            menage['id'] = prefix_id(menage['id'])
+            for role in ('conjoint', 'personne_de_reference'):
+                menage[role] = prefix_id(menage.get(role))
+            for role in ('autres', 'enfants'):
+                menage[role] = [prefix_id(id) for id in menage.get(role) or []]
+            merged_test_case['menages'].append(menage)
+    return merged_test_case
+
+
+class BatchedSimulation(object):
+    """A single simulation of several tests sharing the same tax benefit system and period.
+
+    Every output variable is calculated once for all the tests, then sliced for each test. When the batched
+    simulation fails, or when its results for a test are wrong, the test is checked again alone, so that its result
+    never depends on the other tests of the batch.
+    """
+    def __init__(self, items):
+        self.checker_by_test_id = dict((id(test), checker) for checker, _, _, _, test, _ in items)
+        self.index_by_test_id = dict((id(item[4]), index) for index, item in enumerate(items))
+        self.scenarios = [item[4]['scenario'] for item in items]
+        self.failed = False
+        self.simulation = None
+        self.value_by_variable_name_and_period = {}
+
+    def calculate(self, test, variable_name, period, calculate_output):
+        if self.simulation is None:
+            for scenario in self.scenarios:
+                scenario.suggest()
+            batched_scenario = self.scenarios[0].tax_benefit_system.new_scenario()
+            batched_scenario.axes = None
+            batched_scenario.input_variables = None
+            batched_scenario.period = self.scenarios[0].period
+            batched_scenario.test_case = merge_cases([scenario.test_case for scenario in self.scenarios])
+            self.simulation = batched_scenario.new_simulation()
+            self.offsets_by_entities_key = dict(
+                (entities_key, np.cumsum([0] + [
+                    len(scenario.test_case[entities_key])
+                    for scenario in self.scenarios
+                    ]))
+                for entities_key in ('foyers_fiscaux', 'individus', 'menages')
+                )
+        key = (variable_name, period, calculate_output)
+        value = self.value_by_variable_name_and_period.get(key)
+        if value is None:
+            calculate = self.simulation.calculate_output if calculate_output else self.simulation.calculate
+            value = calculate(variable_name, period)
+            self.value_by_variable_name_and_period[key] = value
+        entities_key = self.simulation.tax_benefit_system.column_by_name[variable_name].entity.plural
+        offsets = self.offsets_by_entities_key[entities_key]
+        index = self.index_by_test_id[id(test)]
+        return value[offsets[index]:offsets[index + 1]]
+
+    def check(self, yaml_path, name, period_str, test, force, verbose = False):
+        checker = self.checker_by_test_id[id(test)]
+        if self.failed:
+            return checker(yaml_path, name, period_str, test, force, verbose = verbose)
+        calculate_output = checker is check_calculate_output
+        assert_near_function = assert_near_calculate_output if calculate_output else assert_near
+        try:
+            output_variables = test.get(u'output_variables')
+            if output_variables is not None:
+                output_variables_name_to_ignore = test.get(u'output_variables_name_to_ignore') or set()
+                for variable_name, expected_value in output_variables.iteritems():
+                    if not force and variable_name in output_variables_name_to_ignore:
+                        continue
+                    if isinstance(expected_value, dict):
+                        expected_value_by_period = expected_value
+                    else:
+                        expected_value_by_period = {None: expected_value}
+                    for requested_period, expected_value_at_period in expected_value_by_period.iteritems():
+                        assert_near_function(
+                            self.calculate(test, variable_name, requested_period, calculate_output),
+                            expected_value_at_period,
+                            absolute_error_margin = test.get('absolute_error_margin'),
+                            message = u'{}@{}: '.format(variable_name, requested_period or period_str),
+                            relative_error_margin = test.get('relative_error_margin'),
+                            )
+        except Exception:
+            if self.simulation is None:
+                # The batched simulation can't be built: check every test of the batch alone.
+                self.failed = True
+            log.info(u'Batched check of {} failed, checking it alone'.format(name), exc_info = True)
+            return checker(yaml_path, name, period_str, test, force, verbose = verbose)
+        return self.simulation
+
+
+def batch_items(items):
+    """Replace the checkers of tests that can be calculated together, with the checkers of batched simulations.
+
+    Tests are batched together when they share the same checker and period and have neither axes nor input variables.
+    The items of a batch must share the same tax benefit system.
+    """
+    items_by_key = collections.OrderedDict()
+    batched_items = []
+    for item in items:
+        checker, yaml_path, name, period_str, test, force = item
+        scenario = test['scenario']
+        if scenario.axes or scenario.input_variables or scenario.test_case is None:
+            batched_items.append(item)
+        else:
+            items_by_key.setdefault((checker, period_str), []).append(item)
+    for key_items in items_by_key.itervalues():
+        if len(key_items) == 1:
+            batched_items.extend(key_items)
+            continue
+        batched_simulation = BatchedSimulation(key_items)
+        batched_items.extend(
+            (batched_simulation.check, ) + item[1:]
+            for item in key_items
+            )
+    return batched_items
+
+
+def load_yaml_file(yaml_path, tax_benefit_system, options):
+    """Parse and validate the tests of a YAML file.
+
+    Validated tests are stored in the persistent cache, keyed by the content of the file, the tax benefit system, the
+    options and the validation code, so that unchanged files are neither parsed nor validated again.
+    """
+    with open(yaml_path) as yaml_file:
+        yaml_content = yaml_file.read()
+    cache_key = make_cache_key(yaml_content, tax_benefit_system, options)
+    tests_dump = cache.load('yaml_tests', cache_key)
+    if tests_dump is not None:
+        return [
+            load_validated(test_dump, tax_benefit_system)
+            for test_dump in tests_dump
+            ]
+
+    tests = yaml.load(yaml_content)
+    tests, error = conv.pipe(
+        conv.make_item_to_singleton(),
+        conv.uniform_sequence(
+            conv.noop,
+            drop_none_items = True,
+            ),
+        )(tests)
+    if error is not None:
+        embedding_error = conv.embed_error(tests, u'errors', error)
+        assert embedding_error is None, embedding_error
+        raise ValueError("Error in test {}:\n{}".format(yaml_path, yaml.dump(tests, allow_unicode = True,
+            default_flow_style = False, indent = 2, width = 120)))
+
+    validated_tests = []
+    for test in tests:
+        test, error = scenarios.make_json_or_python_to_test(
+            tax_benefit_system = tax_benefit_system,
+            default_absolute_error_margin = options.get('default_absolute_error_margin'),
+            default_relative_error_margin = options.get('default_relative_error_margin'),
+            )(test)
+        if error is not None:
+            embedding_error = conv.embed_error(test, u'errors', error)
+            assert embedding_error is None, embedding_error
+            raise ValueError("Error in test {}:\n{}\nYaml test content: \n{}\n".format(
+                yaml_path, error, yaml.dump(test, allow_unicode = True,
+                default_flow_style = False, indent = 2, width = 120)))
+        validated_tests.append(test)
+    cache.dump('yaml_tests', cache_key, [
+        dump_validated(validated_test)
+        for validated_test in validated_tests
+        ])
+    return validated_tests
+
+
+def make_cache_key(yaml_content, tax_benefit_system, options):
+    return cache.make_key(
+        yaml_content,
+        getattr(tax_benefit_system, 'full_key', None) or '',
+        repr(options.get('default_absolute_error_margin')),
+        repr(options.get('default_relative_error_margin')),
+        # Tests depend on the columns of the tax benefit system (their type, enum, default value...) and on the
+        # validation code of scenarios.
+        '\n'.join(
+            json.dumps(column.to_json(), default = repr, sort_keys = True)
+            for column_name, column in sorted(tax_benefit_system.column_by_name.iteritems())
+            ),
+        repr(os.path.getmtime(tunisia_scenarios.__file__)),
+        repr(os.path.getmtime(scenarios.__file__)),
+        )
 
 
-def run_test(force = False, name_filter = None, options_by_path = None):
+def dump_validated(test):
+    """Return a picklable copy of a validated test, whose scenario is replaced by its attributes."""
+    scenario = test['scenario']
+    test_dump = test.copy()
+    test_dump['scenario'] = dict(
+        axes = scenario.axes,
+        input_variables = scenario.input_variables,
+        period = scenario.period,
+        test_case = scenario.test_case,
+        )
+    return test_dump
+
+
+def load_validated(test_dump, tax_benefit_system):
+    test = test_dump.copy()
+    scenario = tax_benefit_system.new_scenario()
+    for name, value in test_dump['scenario'].iteritems():
+        setattr(scenario, name, value)
+    test['scenario'] = scenario
+    return test
+
+
+def list_yaml_paths(path):
+    if os.path.isdir(path):
+        return [
+            os.path.join(path, filename)
+            for filename in sorted(os.listdir(path))
+            if filename.endswith('.yaml')
+            ]
+    return [path]
+
+
+def run_test(force = False, name_filter = None, options_by_path = None, batch = False, selector = None):
     if isinstance(name_filter, str):
         name_filter = name_filter.decode('utf-8')
     if options_by_path is None:
@@ -204,14 +442,7 @@ def run_test(force = False, name_filter = None, options_by_path = None):
         if not os.path.exists(path):
             log.warning(u'Skipping missing {}'.format(path))
             continue
-        if os.path.isdir(path):
-            yaml_paths = [
-                os.path.join(path, filename)
-                for filename in sorted(os.listdir(path))
-                if filename.endswith('.yaml')
-                ]
-        else:
-            yaml_paths = [path]
+        yaml_paths = list_yaml_paths(path)
 
         if options.get('requires'):
             # Check if the required package was successfully imported in tests/base.py
@@ -224,36 +455,10 @@ def run_test(force = False, name_filter = None, options_by_path = None):
             tax_benefit_system = base.tax_benefit_system,
             ) if reform_keys is not None else base.tax_benefit_system
 
+        path_items = []
         for yaml_path in yaml_paths:
             filename_core = os.path.splitext(os.path.basename(yaml_path))[0]
-            with open(yaml_path) as yaml_file:
-                tests = yaml.load(yaml_file)
-            tests, error = conv.pipe(
-                conv.make_item_to_singleton(),
-                conv.uniform_sequence(
-                    conv.noop,
-                    drop_none_items = True,
-                    ),
-                )(tests)
-            if error is not None:
-                embedding_error = conv.embed_error(tests, u'errors', error)
-                assert embedding_error is None, embedding_error
-                raise ValueError("Error in test {}:\n{}".format(yaml_path, yaml.dump(tests, allow_unicode = True,
-                    default_flow_style = False, indent = 2, width = 120)))
-
-            for test in tests:
-                test, error = scenarios.make_json_or_python_to_test(
-                    tax_benefit_system = tax_benefit_system_for_path,
-                    default_absolute_error_margin = options.get('default_absolute_error_margin'),
-                    default_relative_error_margin = options.get('default_relative_error_margin'),
-                    )(test)
-                if error is not None:
-                    embedding_error = conv.embed_error(test, u'errors', error)
-                    assert embedding_error is None, embedding_error
-                    raise ValueError("Error in test {}:\n{}\nYaml test content: \n{}\n".format(
-                        yaml_path, error, yaml.dump(test, allow_unicode = True,
-                        default_flow_style = False, indent = 2, width = 120)))
-
+            for test in load_yaml_file(yaml_path, tax_benefit_system_for_path, options):
                 if not force and test.get(u'ignore', False):
                     continue
                 if name_filter is not None and name_filter not in filename_core \
@@ -261,8 +466,105 @@ def run_test(force = False, name_filter = None, options_by_path = None):
                         and name_filter not in (test.get('keywords', [])):
                     continue
                 checker = check_calculate_output if options['calculate_output'] else check
-                yield checker, yaml_path, test.get('name') or filename_core, unicode(test['scenario'].period), test, \
-                    force
+                item = (checker, yaml_path, test.get('name') or filename_core, unicode(test['scenario'].period), test,
+                    force)
+                # Variables calculated by reforms in cloned simulations are not recorded: their tests always run.
+                if selector is not None and reform_keys is None and not selector.is_selected(*item[1:4]):
+                    continue
+                if batch:
+                    path_items.append(item)
+                else:
+                    yield item
+
+        if batch:
+            for item in batch_items(path_items):
+                yield item
+
+
+def get_calculated_variables_name(simulation):
+    return sorted(simulation.holder_by_name) if simulation is not None else []
+
+
+# Parallel execution
+
+
+def warm_up():
+    """Build the legislation of the tax benefit system and the cached reforms used by the tests.
+
+    When called before the creation of the worker processes, they inherit them.
+    """
+    base.tax_benefit_system.get_legislation()
+    for options in options_by_dir.itervalues():
+        reform_keys = options.get('reforms')
+        if reform_keys is not None:
+            base.get_cached_composed_reform(
+                reform_keys = reform_keys,
+                tax_benefit_system = base.tax_benefit_system,
+                ).get_legislation()
+
+
+def run_yaml_file(task):
+    """Check the tests of a YAML file.
+
+    Return a list of (yaml_path, name, period, duration, error, variables_name) tuples, where variables_name are the
+    names of the variables calculated by the test.
+    """
+    yaml_path, options, force, name_filter, batch, selector = task
+    results = []
+    try:
+        for checker, _, name, period_str, test, force in run_test(
+                batch = batch,
+                force = force,
+                name_filter = name_filter,
+                options_by_path = {yaml_path: options},
+                selector = selector,
+                ):
+            start_time = time.time()
+            try:
+                simulation = checker(yaml_path, name, period_str, test, force)
+            except Exception:
+                error = traceback.format_exc()
+                variables_name = None
+            else:
+                error = None
+                variables_name = get_calculated_variables_name(simulation)
+            results.append((yaml_path, name, period_str, time.time() - start_time, error, variables_name))
+    except Exception:
+        results.append((yaml_path, None, None, 0, traceback.format_exc(), None))
+    return results
+
+
+def run_in_parallel(jobs, force = False, name_filter = None, options_by_path = None, batch = False,
+        selector = None):
+    """Check the YAML files in a pool of worker processes and return the results of their tests, in files order."""
+    if isinstance(name_filter, str):
+        name_filter = name_filter.decode('utf-8')
+    if options_by_path is None:
+        options_by_path = options_by_dir
+    tasks = [
+        (yaml_path, options, force, name_filter, batch, selector)
+        for path, options in options_by_path.iteritems()
+        if os.path.exists(path)
+        for yaml_path in list_yaml_paths(path)
+        ]
+    # Large files first, so that they don't end last alone.
+    sorted_tasks = sorted(tasks, key = lambda task: -os.path.getsize(task[0]))
+    warm_up()
+    pool = multiprocessing.Pool(processes = jobs, initializer = warm_up)
+    try:
+        tasks_results = pool.map(run_yaml_file, sorted_tasks, chunksize = 1)
+    finally:
+        pool.close()
+        pool.join()
+    results_by_yaml_path = dict(
+        (task[0], task_results)
+        for task, task_results in zip(sorted_tasks, tasks_results)
+        )
+    return [
+        result
+        for task in tasks
+        for result in results_by_yaml_path[task[0]]
+        ]
 
 
 def main():
@@ -272,8 +574,14 @@ def main():
 
     parser = argparse.ArgumentParser(description = __doc__)
     parser.add_argument('paths', help = "path (file or directory) of tests to execute", metavar = 'PATH', nargs = '*')
+    parser.add_argument('-j', '--jobs', default = 1, type = int,
+        help = "number of worker processes checking YAML files in parallel")
     parser.add_argument('-f', '--force', action = 'store_true', default = False,
         help = 'force testing of tests with "ignore" flag and formulas belonging to "ignore_output_variables" list')
+    parser.add_argument('-c', '--changed', action = 'store_true', default = False,
+        help = "execute only the tests affected by the changes of the model and legislation since their last run")
+    parser.add_argument('-b', '--batch', action = 'store_true', default = False,
+        help = "calculate together the tests sharing the same period, in a single simulation")
     parser.add_argument('-n', '--name', default = None, help = "partial name of tests to execute")
     parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
     args = parser.parse_args()
@@ -294,12 +602,47 @@ def main():
     else:
         options_by_path = None
 
+    if args.changed:
+        from openfisca_tunisia.tests import incremental
+        selector = incremental.Selector()
+    else:
+        selector = None
+
+    if args.jobs > 1:
+        results = run_in_parallel(
+            args.jobs,
+            batch = args.batch,
+            force = args.force,
+            name_filter = args.name,
+            options_by_path = options_by_path,
+            selector = selector,
+            )
+        errors_count = 0
+        for yaml_path, name, period_str, duration, error, variables_name in results:
+            if selector is not None and name is not None:
+                selector.record(yaml_path, name, period_str, variables_name)
+            print(u'{} {:.3f}s {} {} - {}'.format(u'ERROR' if error is not None else u'ok', duration, yaml_path,
+                name or u'', period_str or u'').encode('utf-8'))
+            if error is not None:
+                errors_count += 1
+                print(error)
+        print("{} tests, {} errors, {:.3f}s of checks".format(len(results), errors_count,
+            sum(result[3] for result in results)))
+        if selector is not None:
+            selector.save()
+        if not results and selector is None:
+            print("No test found!")
+            sys.exit(1)
+        sys.exit(1 if errors_count else 0)
+
     tests_found = False
     for test_index, (checker, yaml_path, name, period_str, test, force) in enumerate(
             run_test(
+                batch = args.batch,
                 force = args.force,
                 name_filter = args.name,
                 options_by_path = options_by_path,
+                selector = selector,
                 ),
             1):
         keywords = test.get('keywords', [])
@@ -313,9 +656,24 @@ def main():
         print("=" * len(title))
         print(title)
         print("=" * len(title))
-        checker(yaml_path, name, period_str, test, force, args.verbose)
+        if selector is None:
+            checker(yaml_path, name, period_str, test, force, args.verbose)
+        else:
+            try:
+                simulation = checker(yaml_path, name, period_str, test, force, args.verbose)
+            except Exception:
+                selector.record(yaml_path, name, period_str, None)
+                selector.save()
+                raise
+            selector.record(yaml_path, name, period_str, get_calculated_variables_name(simulation))
         tests_found = True
+    if selector is not None:
+        selector.save()
     if not tests_found:
+        if selector is not None:
+            # No test is affected by the changes made since the last run.
+            print("No changed test found.")
+            sys.exit(0)
         print("No test found!")
         sys.exit(1)
 
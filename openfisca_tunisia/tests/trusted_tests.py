@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+
+import copy
+import datetime
+
+from openfisca_core import conv, periods
+
+from openfisca_tunisia import scenarios
+from openfisca_tunisia.tests.base import assert_near, tax_benefit_system
+
+
+def make_case(year):
+    return dict(
+        foyers_fiscaux = [dict(declarants = [u'ind0', u'ind1'], id = u'foy0', personnes_a_charge = [u'ind2'])],
+        individus = [
+            dict(date_naissance = datetime.date(year - 40, 1, 1), id = u'ind0', salaire_de_base = 20000),
+            dict(date_naissance = datetime.date(year - 38, 1, 1), id = u'ind1'),
+            dict(date_naissance = datetime.date(year - 10, 1, 1), id = u'ind2'),
+            ],
+        menages = [dict(autres = [], conjoint = u'ind1', enfants = [u'ind2'], id = u'men0',
+            personne_de_reference = u'ind0')],
+        )
+
+
+def test_trusted_test_case():
+    year = 2011
+    column_by_name_by_entities_key = scenarios.get_column_by_name_by_entities_key(tax_benefit_system)
+    period = periods.period(year)
+    test_case = make_case(year)
+    assert scenarios.is_valid_trusted_test_case(test_case, column_by_name_by_entities_key, period)
+
+    revenu_disponible_by_trusted = {}
+    for trusted in (False, True):
+        scenario = tax_benefit_system.new_scenario()
+        scenario.trusted = trusted
+        conv.check(scenario.make_json_or_python_to_attributes())(dict(period = year, test_case = test_case))
+        revenu_disponible_by_trusted[trusted] = scenario.new_simulation().calculate('revenu_disponible')
+    assert_near(revenu_disponible_by_trusted[True], revenu_disponible_by_trusted[False], absolute_error_margin = 0)
+
+
+def test_invalid_trusted_test_case():
+    year = 2011
+    column_by_name_by_entities_key = scenarios.get_column_by_name_by_entities_key(tax_benefit_system)
+    period = periods.period(year)
+
+    test_case = make_case(year)
+    test_case['individus'].append(dict(date_naissance = datetime.date(year - 30, 1, 1), id = u'ind3'))
+    test_case['foyers_fiscaux'][0]['declarants'].append(u'ind3')
+    test_case['menages'][0]['autres'].append(u'ind3')
+    assert not scenarios.is_valid_trusted_test_case(test_case, column_by_name_by_entities_key, period)
+
+    # Personnes à charge must be younger than 25 or disabled.
+    test_case = make_case(year)
+    test_case['individus'][2]['date_naissance'] = datetime.date(year - 30, 1, 1)
+    assert not scenarios.is_valid_trusted_test_case(test_case, column_by_name_by_entities_key, period)
+    test_case['individus'][2]['inv'] = True
+    assert scenarios.is_valid_trusted_test_case(test_case, column_by_name_by_entities_key, period)
+
+    test_case = make_case(year)
+    test_case['individus'][0]['salaire_de_base'] = u'20000'
+    assert not scenarios.is_valid_trusted_test_case(test_case, column_by_name_by_entities_key, period)
+
+    # Errors are reported by the conversion pipeline.
+    test_case = make_case(year)
+    del test_case['menages'][0]['conjoint']
+    scenario = tax_benefit_system.new_scenario()
+    scenario.trusted = True
+    attributes, error = scenario.make_json_or_python_to_attributes()(dict(period = year, test_case = test_case))
+    assert error is not None
+
+
+def test_cached_conversion_schema():
+    json_or_python_to_entities = scenarios.get_json_or_python_to_entities(tax_benefit_system)
+    assert scenarios.get_json_or_python_to_entities(tax_benefit_system) is json_or_python_to_entities
+    assert 'salaire_de_base' in scenarios.get_column_by_name_by_entities_key(tax_benefit_system)[u'individus']
+
+    # Replacing a column, without changing the columns count, rebuilds the schema.
+    column_by_name = tax_benefit_system.column_by_name
+    column = column_by_name['salaire_de_base']
+    column_by_name['salaire_de_base'] = copy.copy(column)
+    try:
+        assert scenarios.get_json_or_python_to_entities(tax_benefit_system) is not json_or_python_to_entities
+        assert scenarios.get_column_by_name_by_entities_key(tax_benefit_system)[u'individus']['salaire_de_base'] \
+            is column_by_name['salaire_de_base']
+    finally:
+        column_by_name['salaire_de_base'] = column
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import bisect
 import glob
+import inspect
 import os
 
+from openfisca_core import legislations, legislationsxml, periods
 from openfisca_core.taxbenefitsystems import TaxBenefitSystem
 
-from . import decompositions, entities, scenarios
+from . import cache, decompositions, dependencies, entities, folding, scenarios
 from .model import datatrees
 
 COUNTRY_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -13,6 +16,49 @@ EXTENSIONS_PATH = os.path.join(COUNTRY_DIR, 'extensions')
 EXTENSIONS_DIRECTORIES = glob.glob(os.path.join(EXTENSIONS_PATH, '*/'))
 
 
+def make_legislation_cache_key(legislation_xml_info_list, preprocess_legislation = None):
+    """Key of a compiled legislation: content of its XML files and version of the code compiling and preprocessing
+    them."""
+    parts = []
+    for xml_file_path, path_in_legislation_tree in legislation_xml_info_list:
+        with open(xml_file_path, 'rb') as xml_file:
+            parts.append(xml_file.read())
+        parts.append(repr(path_in_legislation_tree))
+    for module in (legislations, legislationsxml):
+        parts.append(repr(os.path.getmtime(module.__file__)))
+    if preprocess_legislation is None:
+        parts.append('')
+    else:
+        preprocessing_module = inspect.getmodule(preprocess_legislation)
+        parts.append(u'{}.{}'.format(preprocess_legislation.__module__, preprocess_legislation.__name__))
+        parts.append(inspect.getsource(preprocessing_module) if preprocessing_module is not None
+            else repr(preprocess_legislation.func_code.co_code))
+    return cache.make_key(*parts)
+
+
+def find_legislation_change_instants(legislation_json):
+    """Return the sorted list of instants at which at least one value of the legislation changes.
+
+    Two instants between the same consecutive change instants share the same dated legislation.
+    """
+    change_instants = set()
+    pending_nodes = [legislation_json]
+    while pending_nodes:
+        node = pending_nodes.pop()
+        if isinstance(node, dict):
+            start = node.get('start')
+            if isinstance(start, basestring):
+                change_instants.add(periods.instant(start))
+            stop = node.get('stop')
+            if isinstance(stop, basestring):
+                # Stop instants are inclusive: the value changes on the next day.
+                change_instants.add(periods.instant(stop).offset(1, 'day'))
+            pending_nodes.extend(node.itervalues())
+        elif isinstance(node, list):
+            pending_nodes.extend(node)
+    return sorted(change_instants)
+
+
 class TunisiaTaxBenefitSystem(TaxBenefitSystem):
     """Tunisian tax benefit system"""
     CURRENCY = u"DT"
@@ -25,8 +71,12 @@ class TunisiaTaxBenefitSystem(TaxBenefitSystem):
         }
 
     columns_name_tree_by_entity = datatrees.columns_name_tree_by_entity
+    dependency_graph = None
+    legislation_change_instants = None
 
     def __init__(self):
+        # Variables whose formula is a stub returning a constant, with this constant
+        self.folded_constant_by_variable_name = {}
         TaxBenefitSystem.__init__(self, entities.entities)
         self.Scenario = scenarios.Scenario
 
@@ -36,3 +86,66 @@ class TunisiaTaxBenefitSystem(TaxBenefitSystem):
         self.add_variables_from_directory(os.path.join(COUNTRY_DIR, 'model'))
         for extension_dir in EXTENSIONS_DIRECTORIES:
             self.load_extension(extension_dir)
+
+    def add_variable(self, variable):
+        """Add a variable, replacing its formula by a shared constant when it is a stub returning a constant, or by
+        an alias of its input when it is a stub returning one of its inputs.
+
+        The inputs of folded constant formulas are never computed.
+        """
+        folded = folding.fold_variable(variable)
+        if folded is not None:
+            (kind, value, _), variable = folded
+            if kind == 'constant':
+                self.folded_constant_by_variable_name[variable.__name__] = value
+        return TaxBenefitSystem.add_variable(self, variable)
+
+    def compute_legislation(self, with_source_file_infos = False):
+        """Load the compiled legislation from the on-disk cache, or compile and cache it.
+
+        Parsing, converting and validating the XML files is paid once per content of these files, instead of once
+        per process.
+        """
+        if with_source_file_infos:
+            # Source file infos are only used for introspection: don't cache them.
+            return TaxBenefitSystem.compute_legislation(self, with_source_file_infos = with_source_file_infos)
+        self.legislation_change_instants = None
+        key = make_legislation_cache_key(self.legislation_xml_info_list,
+            preprocess_legislation = getattr(self, 'preprocess_legislation', None))
+        legislation_json = cache.load('legislation', key)
+        if legislation_json is None:
+            TaxBenefitSystem.compute_legislation(self)
+            cache.dump('legislation', key, self._legislation_json)
+        else:
+            self._legislation_json = legislation_json
+
+    def get_compact_legislation(self, instant, traced_simulation = None):
+        """Return the compact legislation at instant, shared by every instant of the same legislation epoch.
+
+        An epoch is an interval between two consecutive instants at which a value of param.xml changes. Every
+        instant is mapped to the first instant of its epoch before looking up the compact legislation cache, so that
+        monthly or daily simulations reuse a few hundred dated legislations instead of building one per instant.
+        """
+        if traced_simulation is None:
+            instant = self.get_legislation_epoch_instant(instant)
+        return TaxBenefitSystem.get_compact_legislation(self, instant, traced_simulation = traced_simulation)
+
+    def get_dependency_graph(self):
+        """Return the static dependency graph of the variables, extracted once and cached on disk."""
+        if self.dependency_graph is None:
+            self.dependency_graph = dependencies.load_static_graph(self)
+        return self.dependency_graph
+
+    def get_legislation_epoch_instant(self, instant):
+        """Return the first instant of the legislation epoch containing instant."""
+        instant = periods.instant(instant)
+        if self.legislation_change_instants is None:
+            self.legislation_change_instants = find_legislation_change_instants(self.get_legislation())
+        change_instants = self.legislation_change_instants
+        if not change_instants:
+            return instant
+        index = bisect.bisect_right(change_instants, instant)
+        if index == 0:
+            # Before the first change, no value is in force: all these instants share the same legislation.
+            return change_instants[0].offset(-1, 'day')
+        return change_instants[index - 1]
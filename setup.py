@@ -46,7 +46,6 @@ setup(
         'Biryani[datetimeconv] >= 0.10.4',
         'OpenFisca-Core >= 4.1.1b1, < 5.0',
         'PyYAML >= 3.10',
-        'scipy >= 0.12',
         ],
     message_extractors = {'openfisca_tunisia': [
         ('**.py', 'python', None),